@@ -0,0 +1,199 @@
+# Per-APK benchmark of artifact extraction (strings and fields).
+# Compares the single-pass extractor in utils/strings_fields_extractor.py
+#  against the previous approach, which builds Androguard's Analysis object
+#  (AnalyzeAPK) and then traverses its string and field cross-references.
+# Each extraction runs in a fresh process, so that its time and peak
+#  resident memory can be measured in isolation.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, 'utils'))
+
+IMPL_ANALYSIS = 'analysis'
+IMPL_SINGLE_PASS = 'single-pass'
+
+
+def fn_extract_with_analysis(path_to_apk, out_dir):
+    """Reference implementation: the extraction as it was done before
+    the single-pass extractor, writing the same four JSON artifacts."""
+    from androguard.misc import AnalyzeAPK
+    from androguard import session
+    _, _, dx = AnalyzeAPK(path_to_apk, session=session.Session())
+
+    string_object = {}
+    for string_analysis_obj in dx.get_strings():
+        string_value = string_analysis_obj.get_orig_value()
+        for element in string_analysis_obj.get_xref_from():
+            full_name = fn_get_full_name(element[1])
+            if full_name not in string_object:
+                string_object[full_name] = []
+            string_object[full_name].append(string_value)
+
+    field_object = {}
+    field_xref_read = {}
+    field_xref_write = {}
+    for field_analysis in dx.find_fields():
+        field_name = field_analysis.get_field().get_name()
+        field_class = field_analysis.get_field().get_class_name()
+        if field_class not in field_object:
+            field_object[field_class] = []
+        if field_name not in field_object[field_class]:
+            field_object[field_class].append(field_name)
+        for obj_xref, xrefs in [
+                (field_xref_read, field_analysis.get_xref_read()),
+                (field_xref_write, field_analysis.get_xref_write())]:
+            for xref in xrefs:
+                full_name = fn_get_full_name(xref[1])
+                if full_name not in obj_xref:
+                    obj_xref[full_name] = []
+                if field_name not in obj_xref[full_name]:
+                    obj_xref[full_name].append(field_name)
+
+    for filename, obj_artifact in [
+            ('strings.json', string_object),
+            ('fields.json', field_object),
+            ('fields_xref_read.json', field_xref_read),
+            ('fields_xref_write.json', field_xref_write)]:
+        with open(os.path.join(out_dir, filename), 'w') as f:
+            json.dump(obj_artifact, f, indent=4)
+    return True
+
+def fn_get_full_name(method):
+    # Androguard 4 cross-references give MethodAnalysis objects,
+    #  rather than the methods themselves.
+    if hasattr(method, 'get_method'):
+        method = method.get_method()
+    return method.get_class_name() + '->' + method.get_name() + method.get_descriptor()
+
+def fn_extract_single_pass(path_to_apk, out_dir, artifact_format):
+    from strings_fields_extractor import StringsFieldsExtractor
+    # The extractor writes to <basepath>/resources/app_specific,
+    #  and loads shared modules from <basepath>/src.
+    os.symlink(os.path.join(BASE_DIR, 'src'), os.path.join(out_dir, 'src'))
+    for dirname in ['strings', 'fields', 'packed']:
+        os.makedirs(os.path.join(out_dir, 'resources', 'app_specific', dirname))
+    sf_extractor = StringsFieldsExtractor(out_dir, artifact_format)
+    return sf_extractor.fn_extract_fields_and_strings(path_to_apk)
+
+def fn_get_dir_size(path_to_dir):
+    num_bytes = 0
+    for root, _, filenames in os.walk(path_to_dir):
+        for filename in filenames:
+            path_to_file = os.path.join(root, filename)
+            if not os.path.islink(path_to_file):
+                num_bytes += os.path.getsize(path_to_file)
+    return num_bytes
+
+def fn_run_child(impl, path_to_apk, artifact_format):
+    """Runs one extraction in a fresh process. Returns a dict of
+    wall time, peak RSS and artifact size, or None if it failed."""
+    out_dir = tempfile.mkdtemp(prefix='bench_extraction_')
+    try:
+        start_time = time.perf_counter()
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.abspath(__file__),
+            '--child',
+            impl,
+            path_to_apk,
+            out_dir,
+            '--artifact-format',
+            artifact_format
+        ])
+        # wait4 gives the resource usage of this child alone.
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start_time
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            return None
+        # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+        max_rss_bytes = rusage.ru_maxrss
+        if sys.platform != 'darwin':
+            max_rss_bytes *= 1024
+        return {
+            'seconds': seconds,
+            'max_rss_bytes': max_rss_bytes,
+            'artifact_bytes': fn_get_dir_size(out_dir)
+        }
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def fn_format_result(result):
+    if result == None:
+        return 'failed'
+    return '{:.2f}'.format(result['seconds']) + ' s, ' \
+        + '{:.0f}'.format(result['max_rss_bytes'] / (1024 * 1024)) + ' MB peak RSS, ' \
+        + '{:.0f}'.format(result['artifact_bytes'] / 1024) + ' KB artifacts'
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Times artifact extraction, and measures its peak memory, per APK.'
+    )
+    argparser.add_argument(
+        'apks',
+        nargs = '*',
+        help = 'APKs to extract. Defaults to those listed in config/apks.txt.'
+    )
+    argparser.add_argument(
+        '--impl',
+        choices = [IMPL_ANALYSIS, IMPL_SINGLE_PASS],
+        action = 'append',
+        default = None,
+        help = 'implementation(s) to benchmark. Defaults to both.'
+    )
+    argparser.add_argument(
+        '--artifact-format',
+        choices = ['json', 'packed'],
+        default = 'json',
+        help = 'artifact format for the single-pass extractor.'
+    )
+    argparser.add_argument(
+        '--json-output',
+        default = None,
+        help = 'file to write the per-APK results to, as JSON.'
+    )
+    argparser.add_argument(
+        '--child',
+        nargs = 3,
+        default = None,
+        help = argparse.SUPPRESS
+    )
+    args = argparser.parse_args()
+
+    if args.child != None:
+        impl, path_to_apk, out_dir = args.child
+        if impl == IMPL_ANALYSIS:
+            is_extracted = fn_extract_with_analysis(path_to_apk, out_dir)
+        else:
+            is_extracted = fn_extract_single_pass(path_to_apk, out_dir, args.artifact_format)
+        sys.exit(0 if is_extracted == True else 1)
+
+    apk_list = args.apks
+    if len(apk_list) == 0:
+        with open(os.path.join(BASE_DIR, 'config', 'apks.txt')) as f:
+            apk_list = [line.strip() for line in f if line.strip() != '']
+    impls = args.impl
+    if impls == None:
+        impls = [IMPL_ANALYSIS, IMPL_SINGLE_PASS]
+
+    obj_results = {}
+    for path_to_apk in apk_list:
+        obj_results[path_to_apk] = {}
+        print(path_to_apk)
+        for impl in impls:
+            result = fn_run_child(impl, path_to_apk, args.artifact_format)
+            obj_results[path_to_apk][impl] = result
+            print('    ' + impl + ': ' + fn_format_result(result))
+
+    if args.json_output != None:
+        with open(args.json_output, 'w') as f:
+            json.dump(obj_results, f, indent=4)
@@ -0,0 +1,306 @@
+# Benchmark suite. Generates (or reuses) a synthetic corpus, times the main
+#  stages of BLE-GUUIDE on it, and writes the results as JSON, so that
+#  throughput can be tracked across releases.
+# Each benchmark runs in a fresh process, so that its peak resident memory
+#  can be measured in isolation (and isn't affected by the other benchmarks).
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(BASE_DIR, 'benchmarks')
+for module_dir in [
+        os.path.join(BASE_DIR, 'src', 'common'),
+        os.path.join(BASE_DIR, 'src', 'functionality_mapper'),
+        os.path.join(BASE_DIR, 'src', 'analyser'),
+        os.path.join(BASE_DIR, 'utils'),
+        BENCHMARKS_DIR]:
+    sys.path.append(module_dir)
+
+# Bump when the layout of the results file changes.
+RESULTS_VERSION = 1
+
+BENCHMARK_MATCH_SINGLE_WORD = 'match_text_single_word'
+BENCHMARK_MATCH_STRING = 'match_text_string'
+BENCHMARK_APK_MATCHER = 'apk_matcher'
+BENCHMARK_UUID_STATS = 'uuid_stats'
+BENCHMARK_SOOT_TO_SMALI = 'soot_to_smali'
+ALL_BENCHMARKS = [
+    BENCHMARK_MATCH_SINGLE_WORD,
+    BENCHMARK_MATCH_STRING,
+    BENCHMARK_APK_MATCHER,
+    BENCHMARK_UUID_STATS,
+    BENCHMARK_SOOT_TO_SMALI
+]
+
+
+def fn_bench_match_single_word(corpus_dir, args):
+    from category_analysis import CategoryAnalyser
+    from single_word_matching import fn_generate_identifiers
+    # Memoisation is disabled, so that every call does the matching.
+    ca = CategoryAnalyser(corpus_dir, match_memo_size=0)
+    identifiers = fn_generate_identifiers(ca, args.num_identifiers, args.seed)
+    start_time = time.perf_counter()
+    for identifier in identifiers:
+        ca.match_text(identifier, single_word=True)
+    return time.perf_counter() - start_time, len(identifiers)
+
+def fn_bench_match_string(corpus_dir, args):
+    from category_analysis import CategoryAnalyser
+    from synthetic_corpus import SyntheticCorpusGenerator
+    ca = CategoryAnalyser(corpus_dir, match_memo_size=0)
+    # Description-like texts, of around 100 words.
+    generator = SyntheticCorpusGenerator(args.seed)
+    texts = [
+        '. '.join(generator.fn_generate_string() for _ in range(20))
+        for _ in range(args.num_texts)
+    ]
+    start_time = time.perf_counter()
+    for text in texts:
+        ca.match_text(text)
+    return time.perf_counter() - start_time, len(texts)
+
+def fn_bench_apk_matcher(corpus_dir, args):
+    from apk_matcher import ApkMatcher
+    apk_matcher = ApkMatcher(corpus_dir)
+    start_time = time.perf_counter()
+    apk_output = apk_matcher.fn_get_functionality()
+    return time.perf_counter() - start_time, len(apk_output)
+
+def fn_bench_uuid_stats(corpus_dir, args):
+    from analyser import UUIDStatsAnalyser
+    # The analyser logs its statistics. Logging is not what is being measured.
+    logging.disable(logging.CRITICAL)
+    start_time = time.perf_counter()
+    stats_analyser = UUIDStatsAnalyser(corpus_dir)
+    stats_analyser.fn_get_stats()
+    return time.perf_counter() - start_time, len(stats_analyser.input_obj_uuids_per_apk)
+
+def fn_bench_soot_to_smali(corpus_dir, args):
+    from soot_to_smali import SootToSmali
+    from extractor_reader import ExtractorOutputReader
+    path_to_soot = os.path.join(corpus_dir, 'input_output', 'soot_extractor_output.json')
+    path_to_out = os.path.join(tempfile.mkdtemp(prefix='bench_soot_'), 'out.json')
+    try:
+        start_time = time.perf_counter()
+        SootToSmali().convert_soot_json_to_smali(path_to_soot, path_to_out, args.workers)
+        seconds = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(os.path.dirname(path_to_out), ignore_errors=True)
+    num_apks = sum(1 for _ in ExtractorOutputReader(path_to_soot).fn_iter_items())
+    return seconds, num_apks
+
+BENCHMARK_FUNCTIONS = {
+    BENCHMARK_MATCH_SINGLE_WORD: fn_bench_match_single_word,
+    BENCHMARK_MATCH_STRING: fn_bench_match_string,
+    BENCHMARK_APK_MATCHER: fn_bench_apk_matcher,
+    BENCHMARK_UUID_STATS: fn_bench_uuid_stats,
+    BENCHMARK_SOOT_TO_SMALI: fn_bench_soot_to_smali
+}
+
+def fn_run_child(benchmark, corpus_dir, args):
+    """Runs one benchmark in a fresh process. Returns a dict of results,
+    or one with an error message if the benchmark failed."""
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        '--child',
+        benchmark,
+        '--corpus-dir',
+        corpus_dir,
+        '--seed',
+        str(args.seed),
+        '--num-identifiers',
+        str(args.num_identifiers),
+        '--num-texts',
+        str(args.num_texts),
+        '--workers',
+        str(args.workers)
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        return {'error': stderr.decode('utf-8', 'replace').strip().splitlines()[-1:]}
+    return json.loads(stdout.decode('utf-8').strip().splitlines()[-1])
+
+def fn_child_main(args):
+    """Runs a benchmark within this (child) process, and prints its results."""
+    start_time = time.perf_counter()
+    seconds, num_items = BENCHMARK_FUNCTIONS[args.child](args.corpus_dir, args)
+    total_seconds = time.perf_counter() - start_time
+    result = {
+        'seconds': seconds,
+        'setup_seconds': total_seconds - seconds,
+        'items': num_items,
+        'items_per_second': (num_items / seconds) if seconds > 0 else None,
+        'max_rss_bytes': fn_get_max_rss_bytes()
+    }
+    print(json.dumps(result))
+
+def fn_get_max_rss_bytes():
+    """Returns the peak RSS of this process, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+def fn_get_git_commit():
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=BASE_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    except OSError:
+        return None
+    if output.returncode != 0:
+        return None
+    return output.stdout.decode('utf-8').strip()
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Runs the benchmark suite on a synthetic corpus, '
+                      + 'and reports the results as JSON.'
+    )
+    argparser.add_argument(
+        '-n',
+        '--num-apks',
+        type = int,
+        default = 1000,
+        help = 'number of APKs in the generated corpus.'
+    )
+    argparser.add_argument(
+        '--seed',
+        type = int,
+        default = 0,
+        help = 'seed for generating the corpus and inputs.'
+    )
+    argparser.add_argument(
+        '--corpus-dir',
+        default = None,
+        help = 'corpus directory. It is generated if it does not exist. '
+               + 'Defaults to a temporary directory, which is then removed.'
+    )
+    argparser.add_argument(
+        '--artifacts',
+        choices = ['json', 'packed', 'none'],
+        default = 'json',
+        help = 'format of the generated strings/fields artifacts.'
+    )
+    argparser.add_argument(
+        '-b',
+        '--benchmark',
+        choices = ALL_BENCHMARKS,
+        action = 'append',
+        default = None,
+        help = 'benchmark(s) to run. Defaults to all.'
+    )
+    argparser.add_argument(
+        '--num-identifiers',
+        type = int,
+        default = 20000,
+        help = 'number of identifiers for the single word matching benchmark.'
+    )
+    argparser.add_argument(
+        '--num-texts',
+        type = int,
+        default = 500,
+        help = 'number of texts for the string matching benchmark.'
+    )
+    argparser.add_argument(
+        '-w',
+        '--workers',
+        type = int,
+        default = 1,
+        help = 'number of worker processes for the Soot-to-smali benchmark.'
+    )
+    argparser.add_argument(
+        '-o',
+        '--output',
+        default = None,
+        help = 'file to write the results to. Defaults to standard output.'
+    )
+    argparser.add_argument(
+        '--child',
+        choices = ALL_BENCHMARKS,
+        default = None,
+        help = argparse.SUPPRESS
+    )
+    args = argparser.parse_args()
+
+    if args.child != None:
+        fn_child_main(args)
+        sys.exit(0)
+
+    is_temporary_corpus = False
+    corpus_dir = args.corpus_dir
+    if corpus_dir == None:
+        corpus_dir = tempfile.mkdtemp(prefix='bench_corpus_')
+        is_temporary_corpus = True
+    corpus_dir = os.path.abspath(corpus_dir)
+
+    try:
+        path_to_extractor_output = os.path.join(
+            corpus_dir,
+            'input_output',
+            'uuid_extractor_output.json'
+        )
+        generation_seconds = None
+        if not os.path.isfile(path_to_extractor_output):
+            from synthetic_corpus import SyntheticCorpusGenerator
+            start_time = time.perf_counter()
+            SyntheticCorpusGenerator(args.seed).fn_generate_corpus(
+                corpus_dir,
+                args.num_apks,
+                args.artifacts
+            )
+            generation_seconds = time.perf_counter() - start_time
+
+        benchmarks = args.benchmark
+        if benchmarks == None:
+            benchmarks = ALL_BENCHMARKS
+        obj_results = {}
+        for benchmark in benchmarks:
+            print('Running ' + benchmark + '...', file=sys.stderr)
+            obj_results[benchmark] = fn_run_child(benchmark, corpus_dir, args)
+    finally:
+        if is_temporary_corpus == True:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    obj_output = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': fn_get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'num_apks': args.num_apks,
+            'seed': args.seed,
+            'artifacts': args.artifacts,
+            'corpus_generation_seconds': generation_seconds,
+            'num_identifiers': args.num_identifiers,
+            'num_texts': args.num_texts,
+            'workers': args.workers
+        },
+        'results': obj_results
+    }
+    if args.output == None:
+        print(json.dumps(obj_output, indent=4))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(obj_output, f, indent=4)
@@ -0,0 +1,150 @@
+# Microbenchmark for single word matching, i.e., CategoryAnalyser.match_text
+#  with single_word=True, as used for API names and fields during
+#  functionality mapping. Identifiers are synthetic, but built like
+#  the class_end + method names and field names that the matcher sees.
+# The fast path's cost is dominated by the keyword scan, which steps through
+#  the automaton once per character in Python. The scan alone is timed too,
+#  as it bounds how much faster than the naive implementation the fast path
+#  can be (around 5x, for identifiers of 25-30 characters).
+
+import os
+import sys
+import time
+import random
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, 'src', 'functionality_mapper'))
+from category_analysis import CategoryAnalyser
+# Identifiers are built as for the synthetic corpus.
+sys.path.append(os.path.join(BASE_DIR, 'benchmarks'))
+from synthetic_corpus import fn_camel_parts
+
+
+def fn_generate_identifiers(ca, num_identifiers, seed):
+    """Generates API names (class_end + method) and field names.
+    Roughly a third contain a keyword from the database."""
+    rnd = random.Random(seed)
+    keywords = sorted(set(
+        [entry['word'] for entry in ca.keyword_entries]
+        + [joined_w for entry in ca.keyword_entries for joined_w in entry['word_joins']]
+    ))
+    identifiers = []
+    for _ in range(num_identifiers):
+        kind = rnd.random()
+        if kind < 0.6:
+            # Last part of the class, plus the method name.
+            class_parts = fn_camel_parts(rnd, keywords, 1, 3)
+            if rnd.random() < 0.2:
+                class_parts.append('$' + str(rnd.randint(1, 9)))
+            method_parts = fn_camel_parts(rnd, keywords, 1, 3)
+            method_parts[0] = method_parts[0].lower()
+            identifiers.append(''.join(class_parts) + ';' + ''.join(method_parts))
+        elif kind < 0.85:
+            identifiers.append('m' + ''.join(fn_camel_parts(rnd, keywords, 1, 3)))
+        else:
+            identifiers.append('_'.join(part.upper() for part in fn_camel_parts(rnd, keywords, 1, 3)))
+    return identifiers
+
+def fn_naive_single_word_match(ca, text):
+    """Reference implementation, which tests every keyword in the database
+    against the text (as match_text did before the keyword automaton)."""
+    text = text.lower()
+    matches = {'category': [], 'sub-category': [], 'category_subcategory': [], 'words': []}
+    def fn_add(category, sub_category, word):
+        matches['category'].append(category)
+        matches['sub-category'].append(sub_category)
+        matches['category_subcategory'].append(category + ':' + sub_category)
+        matches['words'].append(word)
+    for category in ca.category_keywords:
+        for sub_category in ca.category_keywords[category]:
+            for word in ca.category_keywords[category][sub_category]:
+                if word not in text:
+                    continue
+                word_children = ca.get_all_children(category, sub_category, word)
+                black_list = ca.category_keywords[category][sub_category][word]['blacklist']
+                if len(word_children) > 0:
+                    for next_word in word_children:
+                        for joined_w in [''.join(next_word),
+                                         '-'.join(next_word),
+                                         '_'.join(next_word)]:
+                            if joined_w in text:
+                                fn_add(category, sub_category, joined_w)
+                else:
+                    no_blacklist = True
+                    for blacklist_word in black_list:
+                        if blacklist_word in text:
+                            no_blacklist = False
+                    if no_blacklist == True:
+                        fn_add(category, sub_category, word)
+    return matches
+
+def fn_time_per_call(fn_match, identifiers, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for identifier in identifiers:
+            fn_match(identifier)
+        elapsed = time.perf_counter() - start
+        if (best == None) or (elapsed < best):
+            best = elapsed
+    return best / len(identifiers)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Times single word matching on synthetic smali identifiers.'
+    )
+    argparser.add_argument(
+        '-n',
+        '--num-identifiers',
+        type = int,
+        default = 20000,
+        help = 'number of identifiers to match.'
+    )
+    argparser.add_argument(
+        '--seed',
+        type = int,
+        default = 0,
+        help = 'seed for generating identifiers.'
+    )
+    argparser.add_argument(
+        '--repeats',
+        type = int,
+        default = 3,
+        help = 'number of timed runs (the fastest is reported).'
+    )
+    args = argparser.parse_args()
+
+    # Memoisation is disabled, so that every call does the matching.
+    ca = CategoryAnalyser(BASE_DIR, match_memo_size=0)
+    identifiers = fn_generate_identifiers(ca, args.num_identifiers, args.seed)
+
+    # Both implementations must agree.
+    for identifier in identifiers:
+        if ca.match_text(identifier, single_word=True) \
+                != fn_naive_single_word_match(ca, identifier):
+            print('Mismatch on ' + identifier)
+            sys.exit(1)
+
+    naive_time = fn_time_per_call(
+        lambda identifier: fn_naive_single_word_match(ca, identifier),
+        identifiers,
+        args.repeats
+    )
+    fast_time = fn_time_per_call(
+        lambda identifier: ca.match_text(identifier, single_word=True),
+        identifiers,
+        args.repeats
+    )
+    lowered_identifiers = [identifier.lower() for identifier in identifiers]
+    scan_time = fn_time_per_call(
+        ca.keyword_matcher.find_keywords,
+        lowered_identifiers,
+        args.repeats
+    )
+    print('Identifiers: ' + str(len(identifiers)))
+    print('Naive:     ' + '{:.2f}'.format(naive_time * 1e6) + ' us/call')
+    print('Fast path: ' + '{:.2f}'.format(fast_time * 1e6) + ' us/call')
+    print('  of which keyword scan: ' + '{:.2f}'.format(scan_time * 1e6) + ' us/call')
+    print('Speedup:   ' + '{:.1f}'.format(naive_time / fast_time) + 'x')
@@ -0,0 +1,328 @@
+# Seeded generator for a synthetic BLE-GUUIDE corpus, for benchmarking.
+# Writes, under the output directory:
+#  input_output/uuid_extractor_output.json   (smali-format methods)
+#  input_output/soot_extractor_output.json   (the same, in Soot format)
+#  resources/app_specific/...                (strings and field-read artifacts)
+#  resources/common/...                      (a copy of the repo's resources)
+# UUIDs are drawn from kfus.json, adopted_uuid_list.csv and the SIG member
+#  list, along with custom (random 128-bit) UUIDs, and misuses of the
+#  reserved range. Method, string and field names are built from the
+#  keyword database, so that functionality mapping has realistic work to do.
+# Everything is written one APK at a time, so large corpora can be generated.
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, 'src', 'common'))
+
+RESERVED_BLE_PREFIX = '0000'
+RESERVED_BLE_SUFFIX = '-0000-1000-8000-00805F9B34FB'
+
+ARTIFACTS_JSON = 'json'
+ARTIFACTS_PACKED = 'packed'
+ARTIFACTS_NONE = 'none'
+
+# Proportions of each kind of UUID. DFU (firmware update) UUIDs are
+#  known UUIDs too, but are common enough to be drawn separately.
+UUID_MIX = [
+    ('kfu', 0.2),
+    ('dfu', 0.05),
+    ('adopted', 0.3),
+    ('member', 0.05),
+    ('reserved_misuse', 0.05),
+    ('custom', 0.35)
+]
+# Proportion of UUIDs that are drawn from a pool shared across APKs
+#  (e.g., from common vendor SDKs), rather than generated afresh.
+SHARED_UUID_RATIO = 0.7
+
+# Identifier parts commonly found in Android class, method and field names.
+#  Also used by single_word_matching.py.
+COMMON_PARTS = [
+    'get', 'set', 'on', 'is', 'has', 'update', 'handle', 'init', 'start', 'stop',
+    'Bluetooth', 'Gatt', 'Characteristic', 'Service', 'Callback', 'Manager',
+    'Adapter', 'Device', 'Read', 'Write', 'Changed', 'Connection', 'State',
+    'Value', 'Descriptor', 'Notification', 'Scan', 'Result', 'Handler',
+    'Activity', 'Fragment', 'View', 'Data', 'Helper', 'Util', 'Impl', 'Lambda',
+    'Runnable', 'Task', 'Listener', 'Event', 'Request', 'Response', 'Uuid',
+    'Ble', 'Config', 'Model', 'Repository', 'Presenter', 'Dialog', 'Item'
+]
+FILLER_WORDS = [
+    'the', 'a', 'to', 'of', 'and', 'for', 'your', 'with', 'is', 'not',
+    'please', 'error', 'failed', 'connected', 'device', 'value', 'data'
+]
+# (Java type, smali type) pairs for return and parameter types.
+TYPES = [
+    ('void', 'V'),
+    ('int', 'I'),
+    ('boolean', 'Z'),
+    ('byte[]', '[B'),
+    ('java.lang.String', 'Ljava/lang/String;'),
+    ('android.bluetooth.BluetoothGatt', 'Landroid/bluetooth/BluetoothGatt;'),
+    ('android.bluetooth.BluetoothGattCharacteristic',
+     'Landroid/bluetooth/BluetoothGattCharacteristic;')
+]
+
+
+def fn_camel_parts(rnd, keywords, min_parts, max_parts):
+    """Returns the parts of a camel case identifier. About a third
+    of identifiers include one of the given keywords."""
+    parts = [rnd.choice(COMMON_PARTS) for _ in range(rnd.randint(min_parts, max_parts))]
+    if rnd.random() < 0.35:
+        parts.insert(rnd.randint(0, len(parts)), rnd.choice(keywords).title())
+    return parts
+
+
+class SyntheticCorpusGenerator:
+    def __init__(self, seed=0, common_dir=None):
+        self.rnd = random.Random(seed)
+        if common_dir == None:
+            common_dir = os.path.join(BASE_DIR, 'resources', 'common')
+        self.common_dir = common_dir
+        self.fn_load_uuid_sources()
+        self.fn_load_keywords()
+        self.shared_uuids = [self.fn_generate_uuid() for _ in range(2000)]
+        self.shared_packages = [self.fn_generate_package() for _ in range(50)]
+
+    def fn_load_uuid_sources(self):
+        with open(os.path.join(self.common_dir, 'kfus.json')) as f:
+            obj_kfus = json.load(f)
+        self.kfu_uuids = sorted(set(
+            uuid
+            for kfu_type in obj_kfus
+            for kfu_subtype in obj_kfus[kfu_type]
+            for uuid in obj_kfus[kfu_type][kfu_subtype]
+        ))
+        self.dfu_uuids = sorted(set(
+            uuid
+            for kfu_subtype in obj_kfus['DFU']
+            for uuid in obj_kfus['DFU'][kfu_subtype]
+        ))
+        self.nordic_dfu_uuids = sorted(obj_kfus['DFU']['NORDIC'])
+        self.adopted_uuids = []
+        with open(os.path.join(self.common_dir, 'adopted_uuid_list.csv')) as f:
+            for line in f:
+                split_line = line.strip().split(',')
+                if len(split_line) != 4:
+                    continue
+                self.adopted_uuids.append(
+                    RESERVED_BLE_PREFIX + split_line[2].strip()[2:].upper() + RESERVED_BLE_SUFFIX
+                )
+        with open(os.path.join(self.common_dir, 'sig_member_list.txt')) as f:
+            self.member_uuids = [
+                RESERVED_BLE_PREFIX + line.strip().upper() + RESERVED_BLE_SUFFIX
+                for line in f if line.strip() != ''
+            ]
+
+    def fn_load_keywords(self):
+        with open(os.path.join(self.common_dir, 'functional_categories_database.json')) as f:
+            obj_categories = json.load(f)
+        self.keywords = sorted(set(
+            word
+            for category in obj_categories
+            for sub_category in obj_categories[category]
+            for word in obj_categories[category][sub_category]
+            if word.isalpha()
+        ))
+
+    def fn_generate_uuid(self):
+        rnd = self.rnd
+        kind = rnd.random()
+        for uuid_type, proportion in UUID_MIX:
+            if kind < proportion:
+                break
+            kind -= proportion
+        if uuid_type == 'kfu':
+            uuid = rnd.choice(self.kfu_uuids)
+        elif uuid_type == 'dfu':
+            # Nordic (legacy) DFU is by far the most common.
+            if rnd.random() < 0.5:
+                uuid = rnd.choice(self.nordic_dfu_uuids)
+            else:
+                uuid = rnd.choice(self.dfu_uuids)
+        elif uuid_type == 'adopted':
+            uuid = rnd.choice(self.adopted_uuids)
+        elif uuid_type == 'member':
+            uuid = rnd.choice(self.member_uuids)
+        elif uuid_type == 'reserved_misuse':
+            uuid = RESERVED_BLE_PREFIX + '{:04X}'.format(rnd.getrandbits(16)) + RESERVED_BLE_SUFFIX
+        else:
+            uuid = '{:08X}-{:04X}-{:04X}-{:04X}-{:012X}'.format(
+                rnd.getrandbits(32),
+                rnd.getrandbits(16),
+                rnd.getrandbits(16),
+                rnd.getrandbits(16),
+                rnd.getrandbits(48)
+            )
+        # Apps don't always use upper case.
+        if rnd.random() < 0.1:
+            uuid = uuid.lower()
+        return uuid
+
+    def fn_generate_package(self):
+        rnd = self.rnd
+        return 'com.' + rnd.choice(self.keywords) + str(rnd.randint(0, 99)) \
+            + '.' + rnd.choice(COMMON_PARTS).lower()
+
+    def fn_camel_parts(self, min_parts, max_parts):
+        return fn_camel_parts(self.rnd, self.keywords, min_parts, max_parts)
+
+    def fn_generate_method(self, package):
+        """Returns a method as (smali signature, Soot signature)."""
+        rnd = self.rnd
+        java_class = package + '.' + ''.join(
+            part[0].upper() + part[1:] for part in self.fn_camel_parts(1, 3)
+        )
+        if rnd.random() < 0.2:
+            java_class += '$' + str(rnd.randint(1, 9))
+        method_parts = self.fn_camel_parts(1, 3)
+        method_name = method_parts[0].lower() + ''.join(method_parts[1:])
+        return_type = rnd.choice(TYPES)
+        param_types = [rnd.choice(TYPES[1:]) for _ in range(rnd.randint(0, 3))]
+        smali_method = 'L' + java_class.replace('.', '/') + ';->' + method_name \
+            + '(' + ''.join(t[1] for t in param_types) + ')' + return_type[1]
+        soot_method = '<' + java_class + ': ' + return_type[0] + ' ' + method_name \
+            + '(' + ','.join(t[0] for t in param_types) + ')>'
+        return smali_method, soot_method
+
+    def fn_generate_string(self):
+        rnd = self.rnd
+        words = [rnd.choice(FILLER_WORDS) for _ in range(rnd.randint(1, 8))]
+        if rnd.random() < 0.5:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(self.keywords))
+        return ' '.join(words)
+
+    def fn_generate_apk(self, apk_num):
+        """Returns (apk, smali apk_obj, Soot apk_obj, strings, field reads)."""
+        rnd = self.rnd
+        apk = '{:064X}'.format(rnd.getrandbits(256))
+        if rnd.random() < 0.5:
+            package = rnd.choice(self.shared_packages)
+        else:
+            package = self.fn_generate_package()
+        methods = [self.fn_generate_method(package) for _ in range(rnd.randint(2, 30))]
+
+        smali_uuids = {}
+        soot_uuids = {}
+        for _ in range(rnd.choice([0, 1, 1, 2, 2, 3, 4, 6, 10])):
+            if rnd.random() < SHARED_UUID_RATIO:
+                uuid = rnd.choice(self.shared_uuids)
+            else:
+                uuid = self.fn_generate_uuid()
+            uuid_methods = rnd.sample(methods, min(len(methods), rnd.randint(1, 4)))
+            smali_uuids[uuid] = {'methods': [m[0] for m in uuid_methods]}
+            soot_uuids[uuid] = {'methods': [m[1] for m in uuid_methods]}
+
+        apk_strings = {}
+        apk_field_reads = {}
+        for smali_method, _ in methods:
+            num_strings = rnd.randint(0, 4)
+            if num_strings > 0:
+                apk_strings[smali_method] = [self.fn_generate_string() for _ in range(num_strings)]
+            num_fields = rnd.randint(0, 3)
+            if num_fields > 0:
+                apk_field_reads[smali_method] = [
+                    'm' + ''.join(self.fn_camel_parts(1, 2)) for _ in range(num_fields)
+                ]
+        pkg = package + str(apk_num)
+        return (
+            apk,
+            {'pkg': pkg, 'uuids': smali_uuids},
+            {'pkg': pkg, 'uuids': soot_uuids},
+            apk_strings,
+            apk_field_reads
+        )
+
+    def fn_generate_corpus(self, out_dir, num_apks, artifacts=ARTIFACTS_JSON):
+        io_dir = os.path.join(out_dir, 'input_output')
+        app_specific_dir = os.path.join(out_dir, 'resources', 'app_specific')
+        for dirname in ['strings', 'fields', 'packed']:
+            os.makedirs(os.path.join(app_specific_dir, dirname), exist_ok=True)
+        os.makedirs(io_dir, exist_ok=True)
+        # A copy, so that the keyword snapshot is written within the corpus.
+        common_dir = os.path.join(out_dir, 'resources', 'common')
+        if not os.path.isdir(common_dir):
+            shutil.copytree(
+                self.common_dir,
+                common_dir,
+                ignore=shutil.ignore_patterns('*.pickle')
+            )
+
+        smali_file = open(os.path.join(io_dir, 'uuid_extractor_output.json'), 'w')
+        soot_file = open(os.path.join(io_dir, 'soot_extractor_output.json'), 'w')
+        smali_file.write('{')
+        soot_file.write('{')
+        for apk_num in range(num_apks):
+            apk, smali_obj, soot_obj, apk_strings, apk_field_reads = \
+                self.fn_generate_apk(apk_num)
+            separator = ',\n' if apk_num > 0 else '\n'
+            smali_file.write(separator + json.dumps(apk) + ': ' + json.dumps(smali_obj))
+            soot_file.write(separator + json.dumps(apk) + ': ' + json.dumps(soot_obj))
+            self.fn_write_artifacts(
+                app_specific_dir,
+                apk,
+                apk_strings,
+                apk_field_reads,
+                artifacts
+            )
+        smali_file.write('\n}\n')
+        soot_file.write('\n}\n')
+        smali_file.close()
+        soot_file.close()
+
+    def fn_write_artifacts(self, app_specific_dir, apk, apk_strings, apk_field_reads, artifacts):
+        if artifacts == ARTIFACTS_NONE:
+            return
+        if artifacts == ARTIFACTS_PACKED:
+            from packed_artifacts import fn_write_packed_artifacts, PACKED_EXTENSION, \
+                SECTION_STRINGS, SECTION_XREF_READ
+            fn_write_packed_artifacts(
+                os.path.join(app_specific_dir, 'packed', apk + PACKED_EXTENSION),
+                {SECTION_STRINGS: apk_strings, SECTION_XREF_READ: apk_field_reads}
+            )
+            return
+        with open(os.path.join(app_specific_dir, 'strings', apk + '.json'), 'w') as f:
+            json.dump(apk_strings, f)
+        with open(os.path.join(app_specific_dir, 'fields', apk + '_xref_read.json'), 'w') as f:
+            json.dump(apk_field_reads, f)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Generates a synthetic corpus (extractor output and '
+                      + 'artifacts) for benchmarking.'
+    )
+    argparser.add_argument(
+        'out_dir',
+        help = 'directory to write the corpus to.'
+    )
+    argparser.add_argument(
+        '-n',
+        '--num-apks',
+        type = int,
+        default = 1000,
+        help = 'number of APKs.'
+    )
+    argparser.add_argument(
+        '--seed',
+        type = int,
+        default = 0,
+        help = 'seed for generating the corpus.'
+    )
+    argparser.add_argument(
+        '--artifacts',
+        choices = [ARTIFACTS_JSON, ARTIFACTS_PACKED, ARTIFACTS_NONE],
+        default = ARTIFACTS_JSON,
+        help = 'format of the generated strings/fields artifacts.'
+    )
+    args = argparser.parse_args()
+    SyntheticCorpusGenerator(args.seed).fn_generate_corpus(
+        args.out_dir,
+        args.num_apks,
+        args.artifacts
+    )
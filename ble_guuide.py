@@ -15,6 +15,10 @@ class BleFunctionMapper:
             self.base_dir,
             'input_output'
         ))
+        self.common_dir = os.path.abspath(os.path.join(
+            self.src_dir,
+            'common'
+        ))
         self.analyser_dir = os.path.abspath(os.path.join(
             self.src_dir,
             'analyser'
@@ -25,6 +29,16 @@ class BleFunctionMapper:
         ))
         self.bool_stats_gather = False
         self.bool_map_functionality = False
+        self.num_workers = 1
+        # With --workers, each worker holds its own match memo (including
+        #  the entries loaded from the memo file), in addition to that of
+        #  the main process, so memo memory grows with the number of workers.
+        self.match_memo_size = 1000000
+        self.match_memo_file = os.path.join(
+            self.io_dir,
+            'match_text_memo.pickle'
+        )
+        self.output_format = 'json'
         self.argparser = None
         self.fn_set_args()
         self.fn_get_user_args()
@@ -59,14 +73,59 @@ class BleFunctionMapper:
                    + 'Results will be saved to JSON.'
         )
         
+        self.argparser.add_argument(
+            '--workers',
+            type = int,
+            default = self.num_workers,
+            help = 'number of worker processes to use '
+                   + 'for functionality mapping. '
+                   + 'APKs are sharded across the workers.'
+        )
+        
+        self.argparser.add_argument(
+            '--memo-size',
+            type = int,
+            default = self.match_memo_size,
+            help = 'maximum number of texts whose match results '
+                   + 'are memoised during functionality mapping. '
+                   + 'Each worker holds its own memo of up to this size. '
+                   + '0 disables memoisation.'
+        )
+        
+        self.argparser.add_argument(
+            '--memo-file',
+            default = self.match_memo_file,
+            help = 'file in which memoised match results are '
+                   + 'persisted between runs. '
+                   + 'Pass an empty string to disable persistence.'
+        )
+        
+        self.argparser.add_argument(
+            '--output-format',
+            choices = ['json', 'jsonl'],
+            default = self.output_format,
+            help = 'format of the functionality mapping output. '
+                   + 'json writes apk_matcher_output.json once mapping '
+                   + 'completes. jsonl writes one record per APK to '
+                   + 'apk_matcher_output.jsonl as each APK completes.'
+        )
+        
     def fn_get_user_args(self):
         args = self.argparser.parse_args()
         if args.stats:
             self.bool_stats_gather = args.stats
         if args.map:
             self.bool_map_functionality = args.map
+        self.num_workers = args.workers
+        self.match_memo_size = args.memo_size
+        self.match_memo_file = args.memo_file
+        if self.match_memo_file == '':
+            self.match_memo_file = None
+        self.output_format = args.output_format
         
     def fn_main(self):
+        # Modules shared by the analyser and functionality mapper.
+        sys.path.append(os.path.abspath(self.common_dir))
         if self.bool_stats_gather == True:
             sys.path.append(os.path.abspath(self.analyser_dir))
             from analyser import UUIDStatsAnalyser
@@ -75,12 +134,42 @@ class BleFunctionMapper:
         if self.bool_map_functionality == True:
             sys.path.append(os.path.abspath(self.fmap_dir))
             from apk_matcher import ApkMatcher
-            apk_matcher = ApkMatcher(self.base_dir)
-            apk_output = apk_matcher.fn_get_functionality()
+            apk_matcher = ApkMatcher(
+                self.base_dir,
+                match_memo_size = self.match_memo_size,
+                path_to_match_memo = self.match_memo_file
+            )
+            if self.output_format == 'jsonl':
+                self.fn_map_functionality_jsonl(apk_matcher)
+                return
+            if self.num_workers > 1:
+                apk_output = apk_matcher.fn_get_functionality_parallel(
+                    self.num_workers
+                )
+            else:
+                apk_output = apk_matcher.fn_get_functionality()
             apkoutfile = os.path.join(self.io_dir, 'apk_matcher_output.json')
             with open(apkoutfile, 'w') as f:
                 json.dump(apk_output, f, indent=4)
 
+    def fn_map_functionality_jsonl(self, apk_matcher):
+        # Write out each APK's results as soon as it has been mapped.
+        from output_writer import JsonlOutputWriter
+        apkoutfile = os.path.join(self.io_dir, 'apk_matcher_output.jsonl')
+        output_writer = JsonlOutputWriter(apkoutfile)
+        try:
+            if self.num_workers > 1:
+                apk_matcher.fn_get_functionality_parallel(
+                    self.num_workers,
+                    fn_on_result = output_writer.fn_write_apk
+                )
+            else:
+                apk_matcher.fn_get_functionality(
+                    fn_on_result = output_writer.fn_write_apk
+                )
+        finally:
+            output_writer.fn_close()
+
 if __name__ == '__main__':
     ble_function_mapper = BleFunctionMapper()
     ble_function_mapper.fn_main()
\ No newline at end of file
@@ -4,34 +4,251 @@
 import os
 import sys
 import json
+import argparse
 import requests
 from androguard.misc import *
 from androguard.core import *
 from androguard import session
 
 class PreAnalysisSetup:
-    def __init__(self, basepath):        
+    def __init__(self, basepath, num_workers=1, max_apks_per_worker=50,
+                 max_rss_mb=None, timeout=None, max_attempts=3, force=False,
+                 artifact_format='json', extraction_mode='full'):
         # Initialise paths.
         self.base_dir = basepath
         self.utils_dir = os.path.abspath(os.path.join(
             self.base_dir,
             'utils'
         ))
-        
+        self.config_dir = os.path.abspath(os.path.join(
+            self.base_dir,
+            'config'
+        ))
+        self.io_dir = os.path.abspath(os.path.join(
+            self.base_dir,
+            'input_output'
+        ))
+
+        # Extraction pool configs.
+        self.num_workers = num_workers
+        self.max_apks_per_worker = max_apks_per_worker
+        self.max_rss_bytes = None
+        if max_rss_mb != None:
+            self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.timeout = timeout
+        self.artifact_format = artifact_format
+        self.extraction_mode = extraction_mode
+
         sys.path.append(os.path.abspath(self.utils_dir))
         from strings_fields_extractor import StringsFieldsExtractor
-        self.sf_extractor = StringsFieldsExtractor(self.base_dir)
+        self.sf_extractor = StringsFieldsExtractor(
+            self.base_dir,
+            self.artifact_format,
+            self.extraction_mode
+        )
         
+        # Manifest of already-extracted APKs.
+        from extraction_manifest import ExtractionManifest
+        self.bool_force = force
+        self.manifest = ExtractionManifest(
+            os.path.join(self.io_dir, 'extraction_manifest.json'),
+            self.sf_extractor.fn_get_version(),
+            max_attempts
+        )
+        # Hashes of each APK's target methods (targeted mode only).
+        self.obj_targets_hashes = {}
+
     def fn_perform_pre_analysis_setup(self):
         apk_list_file = os.path.join(
             self.config_dir,
             'apks.txt'
         )
-        
+
         apk_list = open(apk_list_file).read().splitlines()
+        apk_list = [path_to_apk.strip() for path_to_apk in apk_list if path_to_apk.strip() != '']
+        
+        # In targeted mode, only the methods listed in the extractor output
+        #  are extracted. An APK's artifacts are only out of date if
+        #  its own target methods have changed.
+        obj_target_methods = None
+        if self.extraction_mode == 'targeted':
+            from extraction_manifest import fn_hash_methods
+            obj_target_methods = self.sf_extractor.fn_get_target_methods(apk_list)
+            for path_to_apk in apk_list:
+                self.obj_targets_hashes[path_to_apk] = fn_hash_methods(
+                    obj_target_methods[path_to_apk]
+                )
+        
+        # Only extract APKs that are new, changed or previously failed.
+        pending_apks = []
         for path_to_apk in apk_list:
-            self.fn_perform_per_apk_setup(path_to_apk)
-            
-    def fn_perform_per_apk_setup(self, path_to_apk):
+            output_paths = self.sf_extractor.fn_get_output_paths(path_to_apk)
+            if (self.bool_force == True) \
+                    or self.manifest.fn_needs_extraction(
+                        path_to_apk,
+                        output_paths,
+                        self.obj_targets_hashes.get(path_to_apk)
+                    ):
+                pending_apks.append(path_to_apk)
+        print(
+            str(len(apk_list) - len(pending_apks)) 
+            + ' APKs are up to date. Extracting '
+            + str(len(pending_apks)) + ' APKs.'
+        )
+        if obj_target_methods != None:
+            obj_target_methods = {
+                path_to_apk: obj_target_methods[path_to_apk]
+                for path_to_apk in pending_apks
+            }
+            num_with_targets = sum(
+                1 for path_to_apk in pending_apks
+                if len(obj_target_methods[path_to_apk]) > 0
+            )
+            print(
+                str(num_with_targets) + ' of these have target methods '
+                + 'in the extractor output.'
+            )
+        
+        try:
+            if self.num_workers > 0:
+                self.fn_perform_pool_setup(pending_apks, obj_target_methods)
+            else:
+                for path_to_apk in pending_apks:
+                    target_methods = None
+                    if obj_target_methods != None:
+                        target_methods = obj_target_methods[path_to_apk]
+                    is_extracted = self.fn_perform_per_apk_setup(
+                        path_to_apk,
+                        target_methods
+                    )
+                    self.fn_record_result(
+                        path_to_apk,
+                        'done' if is_extracted == True else 'failed'
+                    )
+        finally:
+            self.manifest.fn_save()
+
+    def fn_perform_per_apk_setup(self, path_to_apk, target_methods=None):
         # Strings/fields extraction.
-        self.sf_extractor.fn_extract_fields_and_strings(path_to_apk)
\ No newline at end of file
+        return self.sf_extractor.fn_extract_fields_and_strings(
+            path_to_apk,
+            target_methods
+        )
+        
+    def fn_record_result(self, path_to_apk, status):
+        self.manifest.fn_record(
+            path_to_apk,
+            status,
+            self.sf_extractor.fn_get_output_paths(path_to_apk),
+            self.obj_targets_hashes.get(path_to_apk)
+        )
+
+    def fn_perform_pool_setup(self, apk_list, obj_target_methods=None):
+        # Strings/fields extraction, with each APK handled by a
+        #  (recyclable) worker process.
+        from extraction_pool import ExtractionPool
+        extraction_pool = ExtractionPool(
+            self.base_dir,
+            self.utils_dir,
+            num_workers = self.num_workers,
+            max_apks_per_worker = self.max_apks_per_worker,
+            max_rss_bytes = self.max_rss_bytes,
+            timeout = self.timeout,
+            artifact_format = self.artifact_format,
+            extraction_mode = self.extraction_mode
+        )
+        obj_status = extraction_pool.fn_extract_all(
+            apk_list,
+            self.fn_record_result,
+            obj_target_methods
+        )
+
+        # Summarise.
+        obj_counts = {}
+        for path_to_apk in obj_status:
+            status = obj_status[path_to_apk]
+            if status not in obj_counts:
+                obj_counts[status] = 0
+            obj_counts[status] += 1
+        for status in sorted(obj_counts):
+            print(status + ': ' + str(obj_counts[status]) + ' APKs')
+        return obj_status
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Extracts the artifacts (strings and fields) '
+                      + 'that are needed for functionality mapping, '
+                      + 'from the APKs listed in config/apks.txt.'
+    )
+    argparser.add_argument(
+        '-w',
+        '--workers',
+        type = int,
+        default = 1,
+        help = 'number of extraction worker processes. '
+               + '0 extracts serially within this process.'
+    )
+    argparser.add_argument(
+        '--apks-per-worker',
+        type = int,
+        default = 50,
+        help = 'number of APKs a worker extracts before it is replaced.'
+    )
+    argparser.add_argument(
+        '--max-rss-mb',
+        type = int,
+        default = None,
+        help = 'per-worker resident memory ceiling, in MB. '
+               + 'An APK that takes its worker over this limit is abandoned.'
+    )
+    argparser.add_argument(
+        '--timeout',
+        type = int,
+        default = None,
+        help = 'per-APK extraction timeout, in seconds.'
+    )
+    argparser.add_argument(
+        '--max-attempts',
+        type = int,
+        default = 3,
+        help = 'number of times extraction of an APK is attempted '
+               + '(across runs) before it is given up on.'
+    )
+    argparser.add_argument(
+        '-f',
+        '--force',
+        action = 'store_true',
+        default = False,
+        help = 're-extract all APKs, even those whose artifacts are up to date.'
+    )
+    argparser.add_argument(
+        '--artifact-format',
+        choices = ['json', 'packed'],
+        default = 'json',
+        help = 'format in which artifacts are written. '
+               + 'json writes four JSON files per APK. '
+               + 'packed writes a single compact file per APK.'
+    )
+    argparser.add_argument(
+        '--extraction-mode',
+        choices = ['full', 'targeted'],
+        default = 'full',
+        help = 'methods for which artifacts are extracted. '
+               + 'full extracts all methods. '
+               + 'targeted only extracts the methods listed in '
+               + 'input_output/uuid_extractor_output.json.'
+    )
+    args = argparser.parse_args()
+    pre_analysis_setup = PreAnalysisSetup(
+        os.path.dirname(os.path.abspath(__file__)),
+        num_workers = args.workers,
+        max_apks_per_worker = args.apks_per_worker,
+        max_rss_mb = args.max_rss_mb,
+        timeout = args.timeout,
+        max_attempts = args.max_attempts,
+        force = args.force,
+        artifact_format = args.artifact_format,
+        extraction_mode = args.extraction_mode
+    )
+    pre_analysis_setup.fn_perform_pre_analysis_setup()
@@ -1,14 +1,46 @@
 import os
 import sys
-import copy
 import json
 import logging
+from collections.abc import Mapping
+from kfu_index import KfuIndex
+from extractor_reader import ExtractorOutputReader
 
 # BLE adopted prefix, suffixes.
 RESERVED_BLE_PREFIX = '0000'
 RESERVED_BLE_SUFFIX = '-0000-1000-8000-00805F9B34FB'
 
 
+class ApkSubsetView(Mapping):
+    """
+    Read-only view of a subset of APKs in a per-APK store.
+    Behaves like a dict of APK -> per-APK object, but only holds the APK IDs,
+    so that subsets don't duplicate the per-APK objects.
+    """
+
+    def __init__(self, obj_store):
+        self.obj_store = obj_store
+        # APK IDs, in insertion order.
+        self.obj_apks = {}
+
+    def add(self, apk):
+        self.obj_apks[apk] = None
+
+    def __getitem__(self, apk):
+        if apk not in self.obj_apks:
+            raise KeyError(apk)
+        return self.obj_store[apk]
+
+    def __contains__(self, apk):
+        return apk in self.obj_apks
+
+    def __iter__(self):
+        return iter(self.obj_apks)
+
+    def __len__(self):
+        return len(self.obj_apks)
+
+
 class UUIDStatsAnalyser:
     def __init__(self, basepath):
         # Set up logger.
@@ -44,12 +76,13 @@ class UUIDStatsAnalyser:
         self.input_obj_uuids_per_apk = {}
         self.input_obj_apks_per_uuid = {}
         
-        # Extractor output.
-        self.input_extractor = {}
+        # Extractor output (read incrementally, one APK at a time).
+        self.extractor_reader = None
         self.fn_read_extractor_output()
         
         # Initialise Known UUIDs.
         self.input_obj_kfus = {}
+        self.kfu_index = None
         self.fn_initialise_kfu_obj()
         
         # Read in SLDs info.
@@ -61,21 +94,29 @@ class UUIDStatsAnalyser:
         self.input_obj_ble_service_uuids = {}
         self.fn_initialise_adopted_uuid_obj()
         
-        # Create list of 16-bit member UUIDs.
-        self.input_ble_member_uuids = []
+        # Create set of 16-bit member UUIDs.
+        self.input_ble_member_uuids = set()
         self.fn_initialise_member_uuids()
         
         # Assign values to per-APK and per-UUID objects.
         self.fn_initialise_apk_uuid_obj()
         
-        # Objects to be populated later.
-        self.obj_apks_at_least_one_adopted_uuid = {}
-        self.obj_apks_at_least_one_nongapgattgss_adopted_uuid = {}
-        self.obj_apks_only_adopted = {}
-        self.obj_apks_only_gattgapgss = {}
-        self.obj_apks_notonly_gattgapgss = {}
-        self.obj_apks_only_adopted_with_mismatches = {}
-        self.obj_apks_only_adopted_no_mismatches = {}
+        # Objects to be populated later. These are all views over
+        #  the per-APK object.
+        self.obj_apks_at_least_one_adopted_uuid = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_at_least_one_nongapgattgss_adopted_uuid = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_only_adopted = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_only_gattgapgss = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_notonly_gattgapgss = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_only_adopted_with_mismatches = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_only_adopted_no_mismatches = \
+            ApkSubsetView(self.input_obj_uuids_per_apk)
     
     def fn_get_stats(self):
         # Identify APKs with at least one extracted UUID.
@@ -107,10 +148,7 @@ class UUIDStatsAnalyser:
 
     def fn_read_extractor_output(self):
         src_file = os.path.join(self.io_dir, 'uuid_extractor_output.json')
-        with open(src_file) as f0:
-            input_extractor = json.load(f0)
-        for sha in input_extractor:
-            self.input_extractor[sha.upper()] = input_extractor[sha]
+        self.extractor_reader = ExtractorOutputReader(src_file)
             
     def fn_initialise_slds_obj(self):
         self.logger.info('Initialising SLDs data.')
@@ -127,8 +165,8 @@ class UUIDStatsAnalyser:
             self.common_dir,
             'kfus.json'
         )
-        with open(kfu_file) as f:
-            self.input_obj_kfus = json.load(f)
+        self.kfu_index = KfuIndex(kfu_file)
+        self.input_obj_kfus = self.kfu_index.obj_kfus
     
     def fn_initialise_adopted_uuid_obj(self):
         self.logger.info('Initialising adopted UUID data.')
@@ -162,43 +200,50 @@ class UUIDStatsAnalyser:
         with open(member_uuid_list_file) as f:
             member_uuid_list = f.read().splitlines()
         for member_uuid in member_uuid_list:
-            self.input_ble_member_uuids.append(member_uuid.strip().upper())
+            self.input_ble_member_uuids.add(member_uuid.strip().upper())
 
     def fn_initialise_apk_uuid_obj(self):
         self.logger.info('Initialising per-APK and per-UUID objects.')
 
-        for apk_sha in self.input_extractor:            
+        for apk, pkg, uuids in self.extractor_reader:
+            apk_sha = apk.upper()
+            if apk_sha in self.input_obj_uuids_per_apk:
+                self.logger.warning(
+                    'Duplicate APK in extractor output: ' + apk_sha
+                )
             self.input_obj_uuids_per_apk[apk_sha] = {}
-            self.fn_add_uuids_to_apk_object(apk_sha)
+            self.fn_add_uuids_to_apk_object(apk_sha, pkg, uuids)
         self.logger.debug('Done initialising per-APK and per-UUID objects.')
         num_apks = len(self.input_obj_uuids_per_apk.keys())
         self.logger.info('Data set of ' + str(num_apks) + ' APKs.')
         num_uuids = len(self.input_obj_apks_per_uuid.keys())
         self.logger.info('Data set has ' + str(num_uuids) + ' unique UUIDs.')
             
-    def fn_add_uuids_to_apk_object(self, apk_sha):
-        self.input_obj_uuids_per_apk[apk_sha]['pkg'] = \
-                self.input_extractor[apk_sha]['pkg']
+    def fn_add_uuids_to_apk_object(self, apk_sha, pkg, uuids):
+        self.input_obj_uuids_per_apk[apk_sha]['pkg'] = pkg
         self.input_obj_uuids_per_apk[apk_sha]['uuids'] = {}
-        for uuid in self.input_extractor[apk_sha]['uuids']:
-            self.fn_add_uuid_to_primary_objects(uuid, apk_sha)
+        # Methods already recorded against each UUID of this APK.
+        self.index_apk_methods = {}
+        for uuid in uuids:
+            self.fn_add_uuid_to_primary_objects(
+                uuid,
+                apk_sha,
+                uuids[uuid]['methods']
+            )
+        self.index_apk_methods = {}
             
-    def fn_add_uuid_to_primary_objects(self, uuid, apk_sha):
+    def fn_add_uuid_to_primary_objects(self, uuid, apk_sha, methods):
         uuid_part = uuid.strip().upper()
         if uuid_part == '00000000-0000-1000-8000-00805F9B34FB':
             return
-            
-        methods = \
-            self.input_extractor[apk_sha]['uuids'][uuid]['methods']
         
         # Add to per-apk object.
         uuid_object = self.input_obj_uuids_per_apk[apk_sha]['uuids']
         if uuid_part not in uuid_object:
             uuid_object[uuid_part] = {}
             uuid_object[uuid_part]['methods'] = []
-        for method_part in methods:
-            if method_part not in uuid_object[uuid_part]['methods']:
-                uuid_object[uuid_part]['methods'].append(method_part)
+            self.index_apk_methods[uuid_part] = set()
+        method_set = self.index_apk_methods[uuid_part]
         
         # Add to per-uuid object.
         if uuid_part not in self.input_obj_apks_per_uuid:
@@ -208,14 +253,21 @@ class UUIDStatsAnalyser:
         if apk_sha not in self.input_obj_apks_per_uuid[uuid_part]['apks']:
             self.input_obj_apks_per_uuid[uuid_part]['apks'][apk_sha] = []
         apk_method_list = self.input_obj_apks_per_uuid[uuid_part]['apks'][apk_sha]
+        
+        # The per-apk and per-uuid method lists for this APK/UUID pair 
+        #  are always identical, so they share one membership set.
         for method_part in methods:
-            if method_part not in apk_method_list:
+            if method_part not in method_set:
+                method_set.add(method_part)
+                uuid_object[uuid_part]['methods'].append(method_part)
                 apk_method_list.append(method_part)
             if method_part not in self.input_obj_apks_per_uuid[uuid_part]['methods']:
                 self.input_obj_apks_per_uuid[uuid_part]['methods'][method_part] = []
         apk_list = self.input_obj_apks_per_uuid[uuid_part]['methods'][method_part]
         pkg_sha = self.input_obj_uuids_per_apk[apk_sha]['pkg'] + ' ' + apk_sha
-        if pkg_sha not in apk_list:
+        # APKs are added one at a time, so if this APK is already 
+        #  in the list, it can only be the last entry.
+        if (len(apk_list) == 0) or (apk_list[-1] != pkg_sha):
             apk_list.append(pkg_sha)
         
     def fn_is_uuid_adopted(self, uuid):
@@ -224,7 +276,7 @@ class UUIDStatsAnalyser:
             return False
         if uuid[8:] != RESERVED_BLE_SUFFIX:
             return False
-        if uuid[4:8] not in list(self.input_obj_ble_adopted_uuids.keys()):
+        if uuid[4:8] not in self.input_obj_ble_adopted_uuids:
             return False
         return True
         
@@ -267,21 +319,7 @@ class UUIDStatsAnalyser:
         num_ufu = 0
         for uuid in all_uuids:
             num_uuids += 1
-            ufu = True
-            for category in self.input_obj_kfus:
-                if type(self.input_obj_kfus[category]) is list:
-                    for kfu in self.input_obj_kfus[category]:
-                        if uuid == kfu:
-                            ufu = False
-                            break
-                else:
-                    for subcategory in self.input_obj_kfus[category]:
-                        for kfu in self.input_obj_kfus[category][subcategory]:
-                            if uuid == kfu:
-                                ufu = False
-                                break
-                        if ufu == False:
-                            break
+            ufu = not self.kfu_index.fn_is_kfu(uuid)
             if ufu == True:
                 num_ufu += 1
                 self.list_all_ufus.append(uuid)
@@ -292,20 +330,9 @@ class UUIDStatsAnalyser:
         self.logger.info('Num UFUs: ' + str(num_ufu))
         
     def fn_get_apks_kfu_ufu(self):
-        self.obj_apks_all_kfu = {}
-        self.obj_apks_all_ufu = {}
-        self.obj_apks_both_kfu_ufu = {}
-        all_kfus = []
-        for category in self.input_obj_kfus:
-            if type(self.input_obj_kfus[category]) is list:
-                for kfu in self.input_obj_kfus[category]:
-                    if kfu not in all_kfus:
-                        all_kfus.append(kfu)
-            else:
-                for subcategory in self.input_obj_kfus[category]:
-                    for kfu in self.input_obj_kfus[category][subcategory]:
-                        if kfu not in all_kfus:
-                            all_kfus.append(kfu)
+        self.obj_apks_all_kfu = ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_all_ufu = ApkSubsetView(self.input_obj_uuids_per_apk)
+        self.obj_apks_both_kfu_ufu = ApkSubsetView(self.input_obj_uuids_per_apk)
 
         num_apps_all_kfu = 0
         num_apps_all_ufu = 0
@@ -318,20 +345,20 @@ class UUIDStatsAnalyser:
                 num_apps_none += 1
                 continue
             for uuid in self.input_obj_uuids_per_apk[apk]['uuids']:
-                if uuid in all_kfus:
+                if self.kfu_index.fn_is_kfu(uuid):
                     kfu = True
                 else:
                     ufu = True
             if (kfu == True):
                 if (ufu == True):
                     num_apps_both += 1
-                    self.obj_apks_both_kfu_ufu[apk] = self.input_obj_uuids_per_apk[apk]
+                    self.obj_apks_both_kfu_ufu.add(apk)
                 else:
                     num_apps_all_kfu += 1
-                    self.obj_apks_all_kfu[apk] = self.input_obj_uuids_per_apk[apk]
+                    self.obj_apks_all_kfu.add(apk)
             else:
                 num_apps_all_ufu += 1
-                self.obj_apks_all_ufu[apk] = self.input_obj_uuids_per_apk[apk]
+                self.obj_apks_all_ufu.add(apk)
         self.logger.info('Num apps with all KFUs: ' + str(num_apps_all_kfu))
         self.logger.info('Num apps with all UFUs: ' + str(num_apps_all_ufu))
         self.logger.info('Num apps with both: ' + str(num_apps_both))
@@ -353,11 +380,9 @@ class UUIDStatsAnalyser:
                     continue
                 adopted_nongapgattgss_count += 1
             if adopted_count > 0:
-                self.obj_apks_at_least_one_adopted_uuid[apk] = \
-                    copy.deepcopy(self.input_obj_uuids_per_apk[apk])
+                self.obj_apks_at_least_one_adopted_uuid.add(apk)
             if adopted_nongapgattgss_count > 0:
-                self.obj_apks_at_least_one_nongapgattgss_adopted_uuid[apk] = \
-                    copy.deepcopy(self.input_obj_uuids_per_apk[apk])
+                self.obj_apks_at_least_one_nongapgattgss_adopted_uuid.add(apk)
                     
         # Print logging info.
         num_apks_at_leastone_adopted_uuid = len(
@@ -380,8 +405,7 @@ class UUIDStatsAnalyser:
         for apk in self.input_obj_uuids_per_apk:
             is_all_adopted = self.fn_analyse_adopted_for_single_apk(apk)
             if is_all_adopted == True:
-                self.obj_apks_only_adopted[apk] = \
-                    copy.deepcopy(self.input_obj_uuids_per_apk[apk])
+                self.obj_apks_only_adopted.add(apk)
 
         # Print logging info.
         num_apks_adopted_uuids_only = len(
@@ -406,11 +430,9 @@ class UUIDStatsAnalyser:
         for apk in self.obj_apks_only_adopted:
             is_all_gattgapgss = self.fn_analyse_gattgapgss_for_single_apk(apk)
             if is_all_gattgapgss == True:
-                self.obj_apks_only_gattgapgss[apk] = \
-                    copy.deepcopy(self.obj_apks_only_adopted[apk])
+                self.obj_apks_only_gattgapgss.add(apk)
             else:
-                self.obj_apks_notonly_gattgapgss[apk] = \
-                    copy.deepcopy(self.obj_apks_only_adopted[apk])
+                self.obj_apks_notonly_gattgapgss.add(apk)
         # Print logging info.
         num_apks_gattgapgss_uuids_only = len(
             list(self.obj_apks_only_gattgapgss.keys())
@@ -440,7 +462,7 @@ class UUIDStatsAnalyser:
     def fn_get_breakdown_of_adopted_uuid_categories(self):
         self.apks_per_adopted_uuid_category = {}
         for service in self.input_obj_ble_service_uuids:
-            self.apks_per_adopted_uuid_category[service] = []
+            self.apks_per_adopted_uuid_category[service] = set()
             
         for uuid in self.input_obj_apks_per_uuid:
             is_adopted = self.fn_is_uuid_adopted(uuid)
@@ -449,12 +471,10 @@ class UUIDStatsAnalyser:
             adoped_uuid_part = uuid[4:8]
             service_name = self.input_obj_ble_adopted_uuids[adoped_uuid_part]
             all_apks = self.input_obj_apks_per_uuid[uuid]['apks']
-            for one_apk in all_apks:
-                if one_apk not in self.apks_per_adopted_uuid_category[service_name]:
-                    self.apks_per_adopted_uuid_category[service_name].append(one_apk)
+            self.apks_per_adopted_uuid_category[service_name].update(all_apks)
         
         for service in self.apks_per_adopted_uuid_category:
-            unique_apks = list(set(self.apks_per_adopted_uuid_category[service]))
+            unique_apks = self.apks_per_adopted_uuid_category[service]
             self.logger.info(
                 '   '
                 + service
@@ -471,7 +491,7 @@ class UUIDStatsAnalyser:
             incorrect_per_apk = False
             for uuid in self.input_obj_uuids_per_apk[apk]['uuids']:
                 if ((uuid[0:4] == RESERVED_BLE_PREFIX) and (uuid[8:] == RESERVED_BLE_SUFFIX)):
-                    if ((uuid[4:8] not in list(self.input_obj_ble_adopted_uuids.keys())) and 
+                    if ((uuid[4:8] not in self.input_obj_ble_adopted_uuids) and 
                             (uuid[4:8] not in self.input_ble_member_uuids)):
                         incorrect_per_apk = True
                         break
@@ -490,7 +510,7 @@ class UUIDStatsAnalyser:
         for uuid in self.input_obj_apks_per_uuid:
             incorrect_per_uuid = False
             if ((uuid[0:4] == RESERVED_BLE_PREFIX) and (uuid[8:] == RESERVED_BLE_SUFFIX)):
-                if ((uuid[4:8] not in list(self.input_obj_ble_adopted_uuids.keys())) and 
+                if ((uuid[4:8] not in self.input_obj_ble_adopted_uuids) and 
                         (uuid[4:8] not in self.input_ble_member_uuids)):
                     incorrect_per_uuid = True
             if incorrect_per_uuid == True:
@@ -504,18 +524,18 @@ class UUIDStatsAnalyser:
         self.logger.info(
             'Getting DFU information.'
         )
+        # Per-chipset APKs are kept in insertion order (as dict keys).
         apks_per_chipset = {}
         for chipset in self.input_obj_kfus['DFU']:
-            apks_per_chipset[chipset] = []
+            apks_per_chipset[chipset] = {}
             for chipset_uuid in self.input_obj_kfus['DFU'][chipset]:
                 if chipset_uuid not in self.input_obj_apks_per_uuid:
                     continue
                 apks_per_uuid = self.input_obj_apks_per_uuid[chipset_uuid]['apks']
                 for apk in apks_per_uuid:
-                    if apk not in apks_per_chipset[chipset]:
-                        apks_per_chipset[chipset].append(apk)
+                    apks_per_chipset[chipset][apk] = None
                         
-        apks_with_dfu_uuids = []
+        apks_with_dfu_uuids = set()
         for chipset in apks_per_chipset:
             self.logger.info(
                 '   '
@@ -523,10 +543,8 @@ class UUIDStatsAnalyser:
                 + '   '
                 + str(len(apks_per_chipset[chipset]))
             )
-            for apk in apks_per_chipset[chipset]:
-                if apk not in apks_with_dfu_uuids:
-                    apks_with_dfu_uuids.append(apk)
-        unique_apks_with_dfu_uuids = list(set(apks_with_dfu_uuids))
+            apks_with_dfu_uuids.update(apks_per_chipset[chipset])
+        unique_apks_with_dfu_uuids = apks_with_dfu_uuids
         self.logger.info(
                 str(len(unique_apks_with_dfu_uuids))
                 + ' APKs have at least one DFU UUID'
@@ -534,7 +552,7 @@ class UUIDStatsAnalyser:
               
         for apk in apks_per_chipset['NORDIC']:
             legacy_only_apks = []
-            apk_uuids = list(self.input_obj_uuids_per_apk[apk]['uuids'].keys())
+            apk_uuids = self.input_obj_uuids_per_apk[apk]['uuids']
             secure_uuid_present = False
             for secure_uuid in self.input_obj_kfus['DFU']['NORDIC_SECURE']:
                 if secure_uuid in apk_uuids:
@@ -0,0 +1,104 @@
+import json
+from json.decoder import scanstring
+
+# Initial number of characters to read at a time.
+DEFAULT_READ_SIZE = 1024 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class ExtractorOutputReader:
+    """
+    Incremental reader for uuid_extractor_output.json.
+    Iterating over the reader yields one (apk, pkg, uuids) record at a time,
+    parsing the file as it goes. Only the record being parsed is held in
+    memory, so peak memory depends on the largest single APK record rather
+    than on the size of the file.
+    """
+
+    def __init__(self, path_to_extractor_output, read_size=DEFAULT_READ_SIZE):
+        self.path_to_extractor_output = path_to_extractor_output
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        for apk, apk_obj in self.fn_iter_items():
+            yield apk, apk_obj['pkg'], apk_obj['uuids']
+
+    def fn_iter_items(self):
+        """Yields (apk, apk_obj) pairs, in file order."""
+        with open(self.path_to_extractor_output) as f:
+            self.file = f
+            self.buffer = ''
+            self.pos = 0
+            self.is_eof = False
+            self.current_read_size = self.read_size
+
+            if self.fn_next_char() != '{':
+                raise ValueError('Extractor output must be a JSON object.')
+            self.pos += 1
+            if self.fn_next_char() == '}':
+                return
+            while True:
+                apk = self.fn_parse(self.fn_parse_key)
+                if self.fn_next_char() != ':':
+                    raise ValueError('Expected ":" after key ' + apk)
+                self.pos += 1
+                self.fn_next_char()
+                apk_obj = self.fn_parse(self.fn_parse_value)
+                yield apk, apk_obj
+
+                next_char = self.fn_next_char()
+                self.pos += 1
+                if next_char == '}':
+                    return
+                if next_char != ',':
+                    raise ValueError('Expected "," or "}" after record ' + apk)
+                self.fn_next_char()
+
+    def fn_read_more(self):
+        chunk = self.file.read(self.current_read_size)
+        if chunk == '':
+            self.is_eof = True
+            return False
+        # Drop what has already been consumed.
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def fn_next_char(self):
+        """Skips whitespace, and returns the next character (or '' at end of file)."""
+        while True:
+            while (self.pos < len(self.buffer)) and (self.buffer[self.pos] in WHITESPACE):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.fn_read_more() == False:
+                return ''
+
+    def fn_parse_key(self):
+        if self.pos >= len(self.buffer):
+            raise ValueError('Unexpected end of extractor output.')
+        if self.buffer[self.pos] != '"':
+            raise ValueError('Expected a string key at offset ' + str(self.pos))
+        return scanstring(self.buffer, self.pos + 1)
+
+    def fn_parse_value(self):
+        return self.decoder.raw_decode(self.buffer, self.pos)
+
+    def fn_parse(self, fn_parser):
+        """Parses the item at the current position, reading more of
+        the file for as long as the item is incomplete."""
+        while True:
+            try:
+                item, end = fn_parser()
+            except ValueError:
+                if self.is_eof == True:
+                    raise
+                # Read geometrically more each time, so that re-parsing
+                #  a large incomplete record doesn't become quadratic.
+                self.fn_read_more()
+                self.current_read_size *= 2
+                continue
+            self.current_read_size = self.read_size
+            self.pos = end
+            return item
@@ -0,0 +1,90 @@
+import os
+import json
+import pickle
+
+# Bump when the layout of the cached index changes.
+KFU_INDEX_VERSION = 1
+
+
+class KfuIndex:
+    """
+    Index of Known-Functionality UUIDs (KFUs), mapping each UUID to the
+    (category, subcategory) pairs it is listed under in kfus.json.
+    The index is cached in a compact pickled form next to kfus.json,
+    and is rebuilt whenever kfus.json changes.
+    """
+
+    def __init__(self, path_to_kfus):
+        self.path_to_kfus = path_to_kfus
+        self.path_to_cache = os.path.splitext(path_to_kfus)[0] + '.index.pickle'
+        self.obj_kfus = {}
+        self.obj_memberships = {}
+        if self.fn_load_cache() == False:
+            self.fn_build_index()
+            self.fn_save_cache()
+
+    def fn_get_source_stamp(self):
+        kfus_stat = os.stat(self.path_to_kfus)
+        return (kfus_stat.st_size, kfus_stat.st_mtime_ns)
+
+    def fn_build_index(self):
+        with open(self.path_to_kfus) as f:
+            self.obj_kfus = json.load(f)
+        self.obj_memberships = {}
+        for category in self.obj_kfus:
+            # Categories are normally split into subcategories,
+            #  but may also be a flat list of UUIDs.
+            if type(self.obj_kfus[category]) is list:
+                obj_subcategories = {None: self.obj_kfus[category]}
+            else:
+                obj_subcategories = self.obj_kfus[category]
+            for subcategory in obj_subcategories:
+                for kfu in obj_subcategories[subcategory]:
+                    if kfu not in self.obj_memberships:
+                        self.obj_memberships[kfu] = ()
+                    self.obj_memberships[kfu] = \
+                        self.obj_memberships[kfu] + ((category, subcategory),)
+
+    def fn_load_cache(self):
+        if not os.path.isfile(self.path_to_cache):
+            return False
+        try:
+            with open(self.path_to_cache, 'rb') as f:
+                obj_cache = pickle.load(f)
+        except Exception:
+            return False
+        if obj_cache.get('version') != KFU_INDEX_VERSION:
+            return False
+        if obj_cache.get('source_stamp') != self.fn_get_source_stamp():
+            return False
+        self.obj_kfus = obj_cache['kfus']
+        self.obj_memberships = obj_cache['memberships']
+        return True
+
+    def fn_save_cache(self):
+        obj_cache = {
+            'version': KFU_INDEX_VERSION,
+            'source_stamp': self.fn_get_source_stamp(),
+            'kfus': self.obj_kfus,
+            'memberships': self.obj_memberships
+        }
+        # The cache is only an optimisation, so failing to write it 
+        #  (e.g., on a read-only checkout) is not an error.
+        tmp_path = self.path_to_cache + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(obj_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path_to_cache)
+        except OSError:
+            pass
+
+    def fn_is_kfu(self, uuid):
+        return uuid in self.obj_memberships
+
+    def fn_get_memberships(self, uuid):
+        """Returns a tuple of (category, subcategory) pairs for a UUID
+        (empty if the UUID is not a KFU)."""
+        return self.obj_memberships.get(uuid, ())
+
+    def fn_get_all_kfus(self):
+        return self.obj_memberships.keys()
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+from array import array
+from collections.abc import Mapping
+
+# File layout (all integers are unsigned 32-bit little-endian):
+#   header:         magic, version, number of strings, number of sections
+#   string table:   (number of strings + 1) offsets into the string data,
+#                   then the UTF-8 string data
+#   per section:    number of keys, number of values, number of hash slots,
+#                   then one (key string ID, first value, number of values)
+#                   record per key, then the value string IDs,
+#                   then the hash slots
+# Every string (method signatures, class names, string constants
+#  and field names) is stored once, and referenced by its ID.
+# The hash slots form an open-addressing (linear probing) table over
+#  the CRC32 of each key's UTF-8 bytes. A slot holds (record number + 1),
+#  or 0 if empty. This allows a key to be looked up without
+#  decoding the other keys.
+PACKED_MAGIC = b'BGPK'
+PACKED_VERSION = 2
+PACKED_EXTENSION = '.pack'
+HEADER_FORMAT = '<4sIII'
+SECTION_HEADER_FORMAT = '<III'
+RECORD_FORMAT = '<III'
+
+# Sections, in file order. These correspond to the JSON artifacts
+#  <apk>.json (strings), <apk>.json (fields), <apk>_xref_read.json
+#  and <apk>_xref_write.json.
+SECTION_STRINGS = 'strings'
+SECTION_FIELDS = 'fields'
+SECTION_XREF_READ = 'xref_read'
+SECTION_XREF_WRITE = 'xref_write'
+SECTION_NAMES = (
+    SECTION_STRINGS,
+    SECTION_FIELDS,
+    SECTION_XREF_READ,
+    SECTION_XREF_WRITE
+)
+
+
+def fn_encode(string_value):
+    # Androguard strings can contain lone surrogates.
+    return string_value.encode('utf-8', 'surrogatepass')
+
+def fn_hash_key(encoded_key):
+    return zlib.crc32(encoded_key)
+
+def fn_get_num_slots(num_keys):
+    # A power of two, at most half full.
+    num_slots = 1
+    while num_slots < (num_keys * 2):
+        num_slots *= 2
+    return num_slots
+
+def fn_to_uint32_array(values):
+    arr = array('I', values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+def fn_write_packed_artifacts(path_to_pack, obj_sections):
+    """Writes the artifacts of one APK to a packed file.
+    obj_sections is a dict of section name -> {key: [string, ...]}.
+    Missing sections are written as empty."""
+    string_ids = {}
+    string_list = []
+    def fn_intern(string_value):
+        if string_value not in string_ids:
+            string_ids[string_value] = len(string_list)
+            string_list.append(string_value)
+        return string_ids[string_value]
+
+    packed_sections = []
+    for section_name in SECTION_NAMES:
+        obj_section = obj_sections.get(section_name, {})
+        records = []
+        values = []
+        slots = [0] * fn_get_num_slots(len(obj_section))
+        slot_mask = len(slots) - 1
+        for record_num, key in enumerate(obj_section):
+            key_id = fn_intern(key)
+            records.extend([key_id, len(values), len(obj_section[key])])
+            for value in obj_section[key]:
+                values.append(fn_intern(value))
+            slot = fn_hash_key(fn_encode(key)) & slot_mask
+            while slots[slot] != 0:
+                slot = (slot + 1) & slot_mask
+            slots[slot] = record_num + 1
+        packed_sections.append((len(obj_section), records, values, slots))
+
+    # String table.
+    encoded_strings = [fn_encode(s) for s in string_list]
+    string_offsets = [0]
+    for encoded_string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+
+    tmp_path = path_to_pack + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(
+            HEADER_FORMAT,
+            PACKED_MAGIC,
+            PACKED_VERSION,
+            len(string_list),
+            len(SECTION_NAMES)
+        ))
+        f.write(fn_to_uint32_array(string_offsets).tobytes())
+        f.write(b''.join(encoded_strings))
+        for num_keys, records, values, slots in packed_sections:
+            f.write(struct.pack(
+                SECTION_HEADER_FORMAT,
+                num_keys,
+                len(values),
+                len(slots)
+            ))
+            f.write(fn_to_uint32_array(records).tobytes())
+            f.write(fn_to_uint32_array(values).tobytes())
+            f.write(fn_to_uint32_array(slots).tobytes())
+    os.replace(tmp_path, path_to_pack)
+
+def fn_pack_json_artifacts(path_to_strings, path_to_fields, path_to_pack):
+    """Builds a packed file from an APK's existing JSON artifacts,
+    given the paths to <apk>.json within the strings and fields directories."""
+    obj_sections = {}
+    section_paths = [
+        (SECTION_STRINGS, path_to_strings),
+        (SECTION_FIELDS, path_to_fields),
+        (SECTION_XREF_READ, path_to_fields.replace('.json', '_xref_read.json')),
+        (SECTION_XREF_WRITE, path_to_fields.replace('.json', '_xref_write.json'))
+    ]
+    for section_name, path_to_json in section_paths:
+        if not os.path.isfile(path_to_json):
+            continue
+        with open(path_to_json) as f:
+            obj_sections[section_name] = json.load(f)
+    fn_write_packed_artifacts(path_to_pack, obj_sections)
+
+
+class PackedSection(Mapping):
+    """
+    Read-only dict-like view of one section of a packed artifact file,
+    mapping a key (e.g., a method signature) to its list of strings.
+    Keys are looked up via the section's hash table, so a lookup only
+    reads the bytes of the matching record and its values.
+    """
+
+    def __init__(self, reader, num_keys, records_start, values_start,
+                 num_slots, slots_start):
+        self.reader = reader
+        self.num_keys = num_keys
+        self.records_start = records_start
+        self.values_start = values_start
+        self.num_slots = num_slots
+        self.slots_start = slots_start
+
+    def fn_get_record(self, record_num):
+        return struct.unpack_from(
+            RECORD_FORMAT,
+            self.reader.data,
+            self.records_start + (record_num * 12)
+        )
+
+    def fn_find_record(self, key):
+        """Returns the (key ID, first value, number of values) record
+        for a key, or None if the key is not in this section."""
+        if self.num_keys == 0:
+            return None
+        data = self.reader.data
+        encoded_key = fn_encode(key)
+        slot_mask = self.num_slots - 1
+        slot = fn_hash_key(encoded_key) & slot_mask
+        while True:
+            record_num = struct.unpack_from(
+                '<I',
+                data,
+                self.slots_start + (slot * 4)
+            )[0]
+            if record_num == 0:
+                return None
+            record = self.fn_get_record(record_num - 1)
+            if self.reader.fn_get_encoded_string(record[0]) == encoded_key:
+                return record
+            slot = (slot + 1) & slot_mask
+
+    def __getitem__(self, key):
+        record = self.fn_find_record(key)
+        if record == None:
+            raise KeyError(key)
+        _, start, num_values = record
+        if num_values == 0:
+            return []
+        value_ids = struct.unpack_from(
+            '<' + str(num_values) + 'I',
+            self.reader.data,
+            self.values_start + (start * 4)
+        )
+        fn_get_string = self.reader.fn_get_string
+        return [fn_get_string(string_id) for string_id in value_ids]
+
+    def __contains__(self, key):
+        return self.fn_find_record(key) != None
+
+    def __iter__(self):
+        for record_num in range(self.num_keys):
+            yield self.reader.fn_get_string(self.fn_get_record(record_num)[0])
+
+    def __len__(self):
+        return self.num_keys
+
+
+class PackedArtifactReader:
+    """
+    Reader for a packed artifact file. The file is memory-mapped, and
+    sections are exposed as read-only mappings, which behave like the
+    corresponding JSON artifacts.
+    """
+
+    def __init__(self, path_to_pack):
+        self.path_to_pack = path_to_pack
+        with open(path_to_pack, 'rb') as f:
+            self.num_bytes = os.fstat(f.fileno()).st_size
+            if self.num_bytes == 0:
+                raise ValueError('Empty packed artifact file: ' + path_to_pack)
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.obj_strings = {}
+        self.obj_sections = {}
+        self.fn_parse()
+
+    def fn_parse(self):
+        magic, version, num_strings, num_sections = \
+            struct.unpack_from(HEADER_FORMAT, self.data, 0)
+        if (magic != PACKED_MAGIC) or (version != PACKED_VERSION):
+            raise ValueError('Unsupported packed artifact file: ' + self.path_to_pack)
+        self.string_offsets_start = struct.calcsize(HEADER_FORMAT)
+        self.string_data_start = self.string_offsets_start + ((num_strings + 1) * 4)
+        string_data_size = struct.unpack_from(
+            '<I',
+            self.data,
+            self.string_offsets_start + (num_strings * 4)
+        )[0]
+        pos = self.string_data_start + string_data_size
+
+        # Only the section headers are read here.
+        section_header_size = struct.calcsize(SECTION_HEADER_FORMAT)
+        for section_name in SECTION_NAMES[:num_sections]:
+            num_keys, num_values, num_slots = \
+                struct.unpack_from(SECTION_HEADER_FORMAT, self.data, pos)
+            records_start = pos + section_header_size
+            values_start = records_start + (num_keys * 12)
+            slots_start = values_start + (num_values * 4)
+            self.obj_sections[section_name] = PackedSection(
+                self,
+                num_keys,
+                records_start,
+                values_start,
+                num_slots,
+                slots_start
+            )
+            pos = slots_start + (num_slots * 4)
+
+    def fn_get_encoded_string(self, string_id):
+        start, end = struct.unpack_from(
+            '<II',
+            self.data,
+            self.string_offsets_start + (string_id * 4)
+        )
+        return self.data[self.string_data_start + start:self.string_data_start + end]
+
+    def fn_get_string(self, string_id):
+        # Decoded strings are kept, as the same string is usually
+        #  referenced from many keys.
+        if string_id in self.obj_strings:
+            return self.obj_strings[string_id]
+        string_value = \
+            self.fn_get_encoded_string(string_id).decode('utf-8', 'surrogatepass')
+        self.obj_strings[string_id] = string_value
+        return string_value
+
+    def fn_get_section(self, section_name):
+        if section_name in self.obj_sections:
+            return self.obj_sections[section_name]
+        return PackedSection(self, 0, 0, 0, 0, 0)
+
+
+if __name__ == '__main__':
+    import argparse
+    argparser = argparse.ArgumentParser(
+        description = 'Builds packed artifact files from existing '
+                      + 'JSON artifacts, without re-running extraction.'
+    )
+    argparser.add_argument(
+        'app_specific_dir',
+        help = 'directory containing the strings and fields directories, '
+               + 'e.g., resources/app_specific'
+    )
+    args = argparser.parse_args()
+    strings_dir = os.path.join(args.app_specific_dir, 'strings')
+    fields_dir = os.path.join(args.app_specific_dir, 'fields')
+    packed_dir = os.path.join(args.app_specific_dir, 'packed')
+    num_packed = 0
+    for filename in sorted(os.listdir(strings_dir)):
+        if not filename.endswith('.json'):
+            continue
+        apkname = filename[:-len('.json')]
+        fn_pack_json_artifacts(
+            os.path.join(strings_dir, filename),
+            os.path.join(fields_dir, filename),
+            os.path.join(packed_dir, apkname + PACKED_EXTENSION)
+        )
+        num_packed += 1
+    print('Packed artifacts for ' + str(num_packed) + ' APKs.')
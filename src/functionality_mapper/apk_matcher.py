@@ -1,9 +1,24 @@
 import os
 import json
+import hashlib
+import itertools
+import multiprocessing
 from category_analysis import CategoryAnalyser
+from artifact_cache import ApkArtifactCache, DEFAULT_MAX_CACHE_BYTES
+from match_memo import MatchMemo, DEFAULT_MATCH_MEMO_SIZE
+from kfu_index import KfuIndex
+from extractor_reader import ExtractorOutputReader
+
+# Number of APK records handed to the worker pool at a time.
+POOL_WINDOW_SIZE = 256
+# Default maximum number of memoised per-UUID analysis results.
+DEFAULT_UUID_MEMO_SIZE = 100000
 
 class ApkMatcher:
-    def __init__(self, basepath, is_validation_mode=False, path_to_extractor_output=None):
+    def __init__(self, basepath, is_validation_mode=False, path_to_extractor_output=None,
+                 artifact_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+                 match_memo_size=DEFAULT_MATCH_MEMO_SIZE, path_to_match_memo=None,
+                 load_extractor_output=True, uuid_memo_size=DEFAULT_UUID_MEMO_SIZE):
         # Configs.
         self.bool_is_validation_mode = is_validation_mode
         
@@ -37,10 +52,22 @@ class ApkMatcher:
             self.app_specific_dir,
             'fields'
         ))
+        self.packed_dir = os.path.abspath(os.path.join(
+            self.app_specific_dir,
+            'packed'
+        ))
         
         # Initialise.
         self.fn_initialise_ignore_uuids()
         
+        # Per-APK strings/fields artifacts, shared by all UUIDs of an APK.
+        self.artifact_cache = ApkArtifactCache(
+            self.strings_dir,
+            self.fields_dir,
+            artifact_cache_bytes,
+            self.packed_dir
+        )
+        
         # Load extractor output.
         extractor_output_file = os.path.join(
             self.io_dir,
@@ -48,10 +75,14 @@ class ApkMatcher:
         )
         if path_to_extractor_output != None:
             extractor_output_file = path_to_extractor_output
-        if os.path.isfile(extractor_output_file):
-            with open(extractor_output_file) as f1:
-                self.obj_extractor_output = json.load(f1)
-        else:
+        self.extractor_output_file = extractor_output_file
+        # The extractor output is streamed one APK at a time, rather than
+        #  loaded in full. Pool workers are handed APK records directly.
+        self.extractor_reader = ExtractorOutputReader(extractor_output_file)
+        self.obj_extractor_output = None
+        if load_extractor_output == False:
+            self.obj_extractor_output = {}
+        elif not os.path.isfile(extractor_output_file):
             print('Input file not found!')
             return None
             
@@ -59,37 +90,48 @@ class ApkMatcher:
         self.fn_load_kfus()
         
         # Initialise CategoryAnalyser.
-        self.ca = CategoryAnalyser(self.base_dir)
+        self.ca = CategoryAnalyser(
+            self.base_dir,
+            match_memo_size,
+            path_to_match_memo
+        )
+        
+        # Per-UUID analysis results, keyed on the UUID, its methods
+        #  and the artifacts of those methods, so that they can be
+        #  reused across APKs.
+        self.uuid_memo = MatchMemo(None, uuid_memo_size)
         
         # Initialise output object.
         self.obj_output = {}
 
+    def fn_get_extractor_output(self):
+        # Only needed for per-APK lookups by name, so loaded on first use.
+        if self.obj_extractor_output == None:
+            with open(self.extractor_output_file) as f1:
+                self.obj_extractor_output = json.load(f1)
+        return self.obj_extractor_output
+
     def fn_load_kfus(self):
         kfus_file = os.path.join(self.common_dir, 'kfus.json')
-        with open(kfus_file) as f0:
-            obj_kfus = json.load(f0)
-        # Generate KFU list.
-        self.kfu_list = []
-        for level1_key in obj_kfus:
-            for level2_key in obj_kfus[level1_key]:
-                for uuid in obj_kfus[level1_key][level2_key]:
-                    if uuid not in self.kfu_list:
-                        self.kfu_list.append(uuid)
+        self.kfu_index = KfuIndex(kfus_file)
         
-    def fn_get_functionality(self):
-        checked_uuid_method_pairs = {}
-        for apk in self.obj_extractor_output:
-            for uuid in self.obj_extractor_output[apk]['uuids']:
+    def fn_get_functionality(self, fn_on_result=None):
+        """Maps functionality for all APKs in the extractor output.
+        If given, fn_on_result(apk, per_apk_output) is called as each APK
+        completes, and the APK is not retained in the returned output.
+        """
+        for apk, apk_obj in self.extractor_reader.fn_iter_items():
+            for uuid in apk_obj['uuids']:
                 if uuid in self.list_ignore_uuids:
                     continue
                     
                 # In normal mode, we don't test KFUs.
                 # In validation mode, we don't check UFUs.
                 if self.bool_is_validation_mode == True:
-                    if uuid not in self.kfu_list:
+                    if not self.kfu_index.fn_is_kfu(uuid):
                         continue
                 else:
-                    if uuid in self.kfu_list:
+                    if self.kfu_index.fn_is_kfu(uuid):
                         continue
 
                 # Add keys to output object.
@@ -101,38 +143,13 @@ class ApkMatcher:
                         'final_category': 'N/A'
                     }
                     
-                methods_list = []
-                # If we have already checked the exact same UUID and 
-                #  methods before, don't re-check.
                 methods_list = \
-                    self.obj_extractor_output[apk]['uuids'][uuid]['methods']
+                    apk_obj['uuids'][uuid]['methods']
                 methods_list.sort()
-                str_methods = str(methods_list)
-                if uuid not in checked_uuid_method_pairs:
-                    checked_uuid_method_pairs[uuid] = {
-                        'methods': '',
-                        'categories': {}
-                    }
-                if str_methods == checked_uuid_method_pairs[uuid]['methods']:
-                    assigned_categories = \
-                        checked_uuid_method_pairs[uuid]['categories']
-                    self.obj_output[apk][uuid]['component_categories'] = \
-                        assigned_categories
-                    com_cat = \
-                        self.obj_output[apk][uuid]['component_categories']['combined_categories']
-                    if len(list(set(com_cat))) == 1:
-                        self.obj_output[apk][uuid]['final_category'] = \
-                            com_cat[0]
-                    continue
                 
                 # Get analysis output.
-                uuid_categories = self.fn_perform_analysis_for_uuid(apk, methods_list)
-                
-                # Update list of checked uuid-methods, so that we needn't
-                #  repeat it again.
-                checked_uuid_method_pairs[uuid]['methods'] = str_methods
-                checked_uuid_method_pairs[uuid]['categories'] = \
-                    uuid_categories
+                uuid_categories = \
+                    self.fn_get_memoised_analysis_for_uuid(apk, uuid, methods_list)
                     
                 # Update output 
                 self.obj_output[apk][uuid]['component_categories'] = \
@@ -142,21 +159,121 @@ class ApkMatcher:
                 if len(list(set(com_cat))) == 1:
                     self.obj_output[apk][uuid]['final_category'] = \
                         com_cat[0]
+            if (fn_on_result != None) and (apk in self.obj_output):
+                fn_on_result(apk, self.obj_output.pop(apk))
+        self.fn_print_cache_stats()
+        self.ca.save_match_memo()
+        return self.obj_output
+
+    def fn_get_cache_stats(self):
+        obj_stats = {
+            'artifact_cache': self.artifact_cache.fn_get_stats(),
+            'uuid_memo': self.uuid_memo.get_stats(),
+            'match_memo': None
+        }
+        if self.ca.match_memo != None:
+            obj_stats['match_memo'] = self.ca.match_memo.get_stats()
+        return obj_stats
+
+    def fn_print_cache_stats(self, obj_stats=None):
+        if obj_stats == None:
+            obj_stats = self.fn_get_cache_stats()
+        cache_stats = obj_stats['artifact_cache']
+        print(
+            'Artifact cache: '
+            + str(cache_stats['hits']) + ' hits, '
+            + str(cache_stats['misses']) + ' misses, '
+            + str(cache_stats['evictions']) + ' evictions.'
+        )
+        uuid_memo_stats = obj_stats['uuid_memo']
+        num_lookups = uuid_memo_stats['hits'] + uuid_memo_stats['misses']
+        dedup_ratio = 0
+        if num_lookups > 0:
+            dedup_ratio = uuid_memo_stats['hits'] / num_lookups
+        print(
+            'UUID memo: '
+            + str(uuid_memo_stats['hits']) + ' hits, '
+            + str(uuid_memo_stats['misses']) + ' misses, '
+            + str(uuid_memo_stats['size']) + ' entries '
+            + '(dedup ratio ' + '{:.2f}'.format(dedup_ratio) + ').'
+        )
+        if obj_stats['match_memo'] != None:
+            memo_stats = obj_stats['match_memo']
+            print(
+                'Match memo: '
+                + str(memo_stats['hits']) + ' hits, '
+                + str(memo_stats['misses']) + ' misses, '
+                + str(memo_stats['size']) + ' entries.'
+            )
+                
+    def fn_get_functionality_parallel(self, num_workers, chunksize=8, fn_on_result=None):
+        """Maps functionality with APKs sharded across a pool of worker processes.
+        Each worker builds its own ApkMatcher (and CategoryAnalyser) once.
+        Results are merged in extractor output order, so the output is the same
+        irrespective of the number of workers.
+        Workers hand back their new match memo entries and cache stats with
+        each APK, so that the memo is saved (and stats are printed) by this
+        process, as in fn_get_functionality.
+        fn_on_result behaves as for fn_get_functionality.
+        """
+        worker_args = (
+            self.base_dir,
+            self.bool_is_validation_mode,
+            self.artifact_cache.max_bytes,
+            self.ca.match_memo.max_size if self.ca.match_memo != None else 0,
+            self.ca.match_memo.path_to_memo if self.ca.match_memo != None else None,
+            self.uuid_memo.max_size
+        )
+        apk_items = self.extractor_reader.fn_iter_items()
+        obj_stats = None
+        with multiprocessing.Pool(
+            num_workers,
+            initializer=fn_initialise_worker,
+            initargs=worker_args
+        ) as pool:
+            # Pool.imap consumes its input eagerly, so feed it a window
+            #  of records at a time to keep only that many in memory.
+            while True:
+                window = list(itertools.islice(apk_items, POOL_WINDOW_SIZE))
+                if window == []:
+                    break
+                for apk, per_apk_output, worker_update in pool.imap(
+                        fn_get_functionality_in_worker,
+                        window,
+                        chunksize):
+                    obj_stats = fn_add_stats(obj_stats, worker_update['stats'])
+                    if self.ca.match_memo != None:
+                        for key, value in worker_update['memo_entries']:
+                            self.ca.match_memo.put(key, value)
+                    if per_apk_output == {}:
+                        continue
+                    if fn_on_result != None:
+                        fn_on_result(apk, per_apk_output)
+                    else:
+                        self.obj_output[apk] = per_apk_output
+        if obj_stats != None:
+            # Workers' memos overlap, so report the size of the merged memo.
+            if self.ca.match_memo != None:
+                obj_stats['match_memo']['size'] = len(self.ca.match_memo.obj_memo)
+            self.fn_print_cache_stats(obj_stats)
+        self.ca.save_match_memo()
         return self.obj_output
                 
-    def fn_get_per_apk_functionality(self, apk):
+    def fn_get_per_apk_functionality(self, apk, apk_obj=None):
+        if apk_obj == None:
+            apk_obj = self.fn_get_extractor_output()[apk]
         per_apk_output = {}
-        for uuid in self.obj_extractor_output[apk]:
+        for uuid in apk_obj['uuids']:
             if uuid in self.list_ignore_uuids:
                 continue
                 
             # In normal mode, we don't test KFUs.
             # In validation mode, we don't check UFUs.
             if self.bool_is_validation_mode == True:
-                if uuid not in self.kfu_list:
+                if not self.kfu_index.fn_is_kfu(uuid):
                     continue
             else:
-                if uuid in self.kfu_list:
+                if self.kfu_index.fn_is_kfu(uuid):
                     continue
 
             # Add keys to output object.
@@ -166,15 +283,13 @@ class ApkMatcher:
                     'final_category': 'N/A'
                 }
                 
-            methods_list = []
-            # If we have already checked the exact same UUID and 
-            #  methods before, don't re-check.
             methods_list = \
-                self.obj_extractor_output[apk]['uuids'][uuid]['methods']
+                apk_obj['uuids'][uuid]['methods']
             methods_list.sort()
 
             # Get analysis output.
-            uuid_categories = self.fn_perform_analysis_for_uuid(apk, methods_list)
+            uuid_categories = \
+                self.fn_get_memoised_analysis_for_uuid(apk, uuid, methods_list)
 
             # Update output 
             per_apk_output[uuid]['component_categories'] = \
@@ -186,7 +301,40 @@ class ApkMatcher:
                     com_cat[0]
         return per_apk_output
         
-    def fn_perform_analysis_for_uuid(self, apk, methods_list):
+    def fn_get_memoised_analysis_for_uuid(self, apk, uuid, methods_list):
+        # If we have already analysed the exact same UUID, methods
+        #  and method artifacts before (in any APK), don't re-analyse.
+        # The APK's artifacts are looked up once per UUID, and shared by
+        #  the memo key and the analysis.
+        apk_artifacts = self.artifact_cache.fn_get_artifacts(apk)
+        memo_key = self.fn_get_uuid_memo_key(uuid, methods_list, apk_artifacts)
+        uuid_categories = self.uuid_memo.get(memo_key)
+        if uuid_categories == None:
+            uuid_categories = self.fn_perform_analysis_for_uuid(methods_list, apk_artifacts)
+            self.uuid_memo.put(memo_key, uuid_categories)
+        return uuid_categories
+
+    def fn_get_uuid_memo_key(self, uuid, methods_list, apk_artifacts):
+        """Returns (uuid, hash of methods, hash of the methods' strings and fields).
+        methods_list must be sorted, so that the same set of methods
+        always gives the same key. apk_artifacts is as returned by
+        ApkArtifactCache.fn_get_artifacts."""
+        methods_hash = hashlib.sha256(
+            json.dumps(methods_list).encode('utf-8')
+        ).digest()
+        # Only the artifacts of the given methods affect the analysis.
+        apk_strings, apk_fields, method_index = apk_artifacts
+        method_artifacts = [
+            [apk_strings.get(method_key, []), apk_fields.get(method_key, [])]
+            for method in methods_list
+            for method_key in method_index.fn_get_keys(method)
+        ]
+        artifacts_hash = hashlib.sha256(
+            json.dumps(method_artifacts).encode('utf-8')
+        ).digest()
+        return (uuid, methods_hash, artifacts_hash)
+
+    def fn_perform_analysis_for_uuid(self, methods_list, apk_artifacts):
         out_categories = {
             'api_categories': [],
             'string_categories': [],
@@ -194,59 +342,40 @@ class ApkMatcher:
             'combined_categories': []
         }
         
-        # Load strings file.
-        strings_json = os.path.join(
-            self.strings_dir,
-            apk + '.json'
-        )
-        if os.path.isfile(strings_json):
-            with open(strings_json) as fs:
-                apk_strings = json.load(fs)
-        else:
-            apk_strings = {}
+        # Strings and fields (read xrefs) artifacts.
+        apk_strings, apk_fields, method_index = apk_artifacts
         
-        # Load fields file.
-        fields_json = os.path.join(
-            self.fields_dir,
-            apk + '_xref_read.json'
-        )
-        if os.path.isfile(fields_json):
-            with open(fields_json) as fs:
-                apk_fields = json.load(fs)
-        else:
-            apk_fields = {}
-            
+        # Gather the texts of each type across all methods, so that
+        #  each type can be matched as a single batch.
+        api_texts = []
+        string_texts = []
+        field_texts = []
         for smali_class_method in methods_list:
             # API check.
             smali_class = smali_class_method.split('->')[0]
             smali_method_desc = smali_class_method.split('->')[1]
             smali_method = smali_method_desc.split('(')[0]
             class_end = smali_class.split('/')[-1]
-            last_class_part_method = class_end + smali_method
-            name_categories = self.ca.match_text(last_class_part_method, single_word=True)
-            set_categories = list(set(name_categories['category_subcategory']))
-            for category_subcategory in set_categories:
-                out_categories['api_categories'].append(category_subcategory)
-                
-            # Strings check.
-            strings_list = []
-            if smali_class_method in apk_strings:
-                strings_list = apk_strings[smali_class_method]
-            for individual_string in strings_list:
-                name_categories = self.ca.match_text(individual_string, single_word=True)
-                set_categories = list(set(name_categories['category_subcategory']))
-                for category_subcategory in set_categories:
-                    out_categories['string_categories'].append(category_subcategory)
+            api_texts.append(class_end + smali_method)
                 
-            # Fields check.
-            fields_list = []
-            if smali_class_method in apk_fields:
-                fields_list = apk_fields[smali_class_method]
-            for individual_field in fields_list:
-                name_categories = self.ca.match_text(individual_field, single_word=True)
-                set_categories = list(set(name_categories['category_subcategory']))
-                for category_subcategory in set_categories:
-                    out_categories['field_categories'].append(category_subcategory)
+            # Methods without a descriptor resolve to all their overloads.
+            for method_key in method_index.fn_get_keys(smali_class_method):
+                # Strings check.
+                if method_key in apk_strings:
+                    string_texts.extend(apk_strings[method_key])
+                    
+                # Fields check.
+                if method_key in apk_fields:
+                    field_texts.extend(apk_fields[method_key])
+        
+        # Each text contributes each of its categories once.
+        for category_type, texts in [
+                ('api_categories', api_texts),
+                ('string_categories', string_texts),
+                ('field_categories', field_texts)]:
+            match_matrix = self.ca.match_texts(texts, single_word=True)
+            out_categories[category_type] = \
+                match_matrix.fn_get_distinct_categories_per_row()
             
         # Combine.
         out_categories['combined_categories'] = out_categories['api_categories'] \
@@ -272,4 +401,69 @@ class ApkMatcher:
             '0000290D-0000-1000-8000-00805F9B34FB',
             '0000290E-0000-1000-8000-00805F9B34FB'
         ]
-        
\ No newline at end of file
+
+
+# Per-process matcher, used by fn_get_functionality_parallel.
+worker_matcher = None
+# The worker's cache stats as last handed back.
+worker_stats = None
+
+def fn_initialise_worker(basepath, is_validation_mode, artifact_cache_bytes,
+                         match_memo_size, path_to_match_memo, uuid_memo_size):
+    global worker_matcher, worker_stats
+    # Each worker loads its own copy of the persisted memo, so its memory
+    #  is paid once per worker. Workers don't write the memo back, as
+    #  concurrent writes would clobber each other. Instead, they hand
+    #  their new entries to the parent, which saves the memo.
+    worker_matcher = ApkMatcher(
+        basepath,
+        is_validation_mode,
+        artifact_cache_bytes=artifact_cache_bytes,
+        match_memo_size=match_memo_size,
+        path_to_match_memo=path_to_match_memo,
+        load_extractor_output=False,
+        uuid_memo_size=uuid_memo_size
+    )
+    if worker_matcher.ca.match_memo != None:
+        worker_matcher.ca.match_memo.track_new_entries()
+    worker_stats = worker_matcher.fn_get_cache_stats()
+
+def fn_get_functionality_in_worker(apk_item):
+    """Returns (apk, per-APK output, update), where update holds the match memo
+    entries and the changes to the cache stats since the previous APK."""
+    global worker_stats
+    apk, apk_obj = apk_item
+    per_apk_output = worker_matcher.fn_get_per_apk_functionality(apk, apk_obj)
+    current_stats = worker_matcher.fn_get_cache_stats()
+    stats_delta = fn_add_stats(current_stats, worker_stats, -1)
+    worker_stats = current_stats
+    memo_entries = []
+    if worker_matcher.ca.match_memo != None:
+        memo_entries = worker_matcher.ca.match_memo.pop_new_entries()
+    worker_update = {
+        'stats': stats_delta,
+        'memo_entries': memo_entries
+    }
+    return apk, per_apk_output, worker_update
+
+def fn_add_stats(obj_stats, obj_other_stats, sign=1):
+    """Returns obj_stats plus (or, with sign -1, minus) obj_other_stats,
+    as returned by ApkMatcher.fn_get_cache_stats. obj_stats may be None."""
+    if obj_stats == None:
+        return fn_add_stats(
+            {name: None for name in obj_other_stats},
+            obj_other_stats,
+            sign
+        )
+    obj_sum = {}
+    for name in obj_other_stats:
+        if obj_other_stats[name] == None:
+            obj_sum[name] = obj_stats[name]
+            continue
+        obj_sum[name] = {}
+        for stat in obj_other_stats[name]:
+            value = 0
+            if obj_stats[name] != None:
+                value = obj_stats[name][stat]
+            obj_sum[name][stat] = value + sign * obj_other_stats[name][stat]
+    return obj_sum
@@ -0,0 +1,146 @@
+import os
+import json
+from collections import OrderedDict
+from packed_artifacts import PackedArtifactReader, PACKED_EXTENSION, \
+    SECTION_STRINGS, SECTION_XREF_READ
+
+# Functionality mapping visits each APK once, in extractor output order,
+#  so an APK's artifacts are only reused across its own UUIDs. Parsed
+#  artifacts take several times their on-disk size in memory, so only
+#  the current (and previous) APK are kept by default.
+DEFAULT_MAX_CACHE_ENTRIES = 2
+# Default budget for cached artifacts, measured as on-disk artifact size.
+#  Beyond this, only the most recently loaded APK is kept.
+DEFAULT_MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+class MethodKeyIndex:
+    """
+    Resolves methods to the keys of an APK's artifacts. Artifact keys are
+    full signatures (Lcls;->name(desc)ret), but methods in the extractor
+    output may lack the descriptor (Lcls;->name), e.g., if they were
+    converted from Soot format. Such a method resolves to the keys of all
+    of its overloads, via an index from Lcls;->name to keys. The index is
+    built from the artifacts' keys on the first descriptor-less lookup.
+    """
+
+    def __init__(self, artifact_sections):
+        self.artifact_sections = artifact_sections
+        self.obj_overloads = None
+
+    def fn_get_keys(self, method):
+        if '(' in method:
+            return [method]
+        if self.obj_overloads == None:
+            self.fn_build()
+        return self.obj_overloads.get(method, [])
+
+    def fn_build(self):
+        # Ordered sets, as a key can be in more than one section.
+        obj_overloads = {}
+        for artifact_section in self.artifact_sections:
+            for key in artifact_section:
+                class_method = key.split('(', 1)[0]
+                if class_method not in obj_overloads:
+                    obj_overloads[class_method] = {}
+                obj_overloads[class_method][key] = None
+        self.obj_overloads = {
+            class_method: list(obj_overloads[class_method])
+            for class_method in obj_overloads
+        }
+
+
+class ApkArtifactCache:
+    """
+    Least-recently-used cache of per-APK strings and field-read artifacts.
+    The size of an entry is taken to be the on-disk size of its files,
+    and the least recently used APKs are evicted once the total exceeds max_bytes.
+    No more than max_entries APKs are cached. The most recently loaded APK
+    is always retained, whatever its size.
+    A packed artifact file is used in preference to JSON artifacts, if one exists.
+    """
+
+    def __init__(self, strings_dir, fields_dir, max_bytes=DEFAULT_MAX_CACHE_BYTES,
+                 packed_dir=None, max_entries=DEFAULT_MAX_CACHE_ENTRIES):
+        self.strings_dir = strings_dir
+        self.fields_dir = fields_dir
+        self.packed_dir = packed_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.obj_cache = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fn_get_artifacts(self, apk):
+        """Returns (apk_strings, apk_fields, method_index) for an APK,
+        loading them on a miss. method_index is the APK's MethodKeyIndex."""
+        if apk in self.obj_cache:
+            self.hits += 1
+            self.obj_cache.move_to_end(apk)
+            return self.obj_cache[apk]['artifacts']
+
+        self.misses += 1
+        packed_artifacts = self.fn_load_packed(apk)
+        if packed_artifacts != None:
+            apk_strings, apk_fields, num_bytes = packed_artifacts
+        else:
+            apk_strings, strings_bytes = self.fn_load_json(
+                os.path.join(self.strings_dir, apk + '.json')
+            )
+            apk_fields, fields_bytes = self.fn_load_json(
+                os.path.join(self.fields_dir, apk + '_xref_read.json')
+            )
+            num_bytes = strings_bytes + fields_bytes
+        apk_artifacts = (
+            apk_strings,
+            apk_fields,
+            MethodKeyIndex([apk_strings, apk_fields])
+        )
+        self.obj_cache[apk] = {
+            'artifacts': apk_artifacts,
+            'bytes': num_bytes
+        }
+        self.current_bytes += num_bytes
+        self.fn_evict()
+        return apk_artifacts
+
+    def fn_load_packed(self, apk):
+        """Returns (apk_strings, apk_fields, bytes) from an APK's packed
+        artifact file, or None if it has none. The file is memory-mapped and
+        indexed by method signature, so only the looked-up methods are read."""
+        if self.packed_dir == None:
+            return None
+        path_to_pack = os.path.join(self.packed_dir, apk + PACKED_EXTENSION)
+        if not os.path.isfile(path_to_pack):
+            return None
+        reader = PackedArtifactReader(path_to_pack)
+        return (
+            reader.fn_get_section(SECTION_STRINGS),
+            reader.fn_get_section(SECTION_XREF_READ),
+            reader.num_bytes
+        )
+
+    def fn_load_json(self, path_to_json):
+        if not os.path.isfile(path_to_json):
+            return {}, 0
+        with open(path_to_json) as f:
+            obj_json = json.load(f)
+        return obj_json, os.path.getsize(path_to_json)
+
+    def fn_evict(self):
+        while ((self.current_bytes > self.max_bytes)
+                or (len(self.obj_cache) > self.max_entries)) \
+                and (len(self.obj_cache) > 1):
+            _, evicted = self.obj_cache.popitem(last=False)
+            self.current_bytes -= evicted['bytes']
+            self.evictions += 1
+
+    def fn_get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'cached_apks': len(self.obj_cache),
+            'cached_bytes': self.current_bytes
+        }
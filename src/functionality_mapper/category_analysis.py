@@ -1,15 +1,42 @@
 import re
 import os
-import nltk
 import json
-import requests
-import html2text
-from nltk.wsd import lesk
-from nltk import word_tokenize, regexp_tokenize
-from nltk.corpus import wordnet as wn
-from nltk.stem.snowball import SnowballStemmer
+import pickle
+import hashlib
+from bisect import bisect_left, bisect_right
+from keyword_matcher import KeywordMatcher
+from match_memo import MatchMemo, DEFAULT_MATCH_MEMO_SIZE
+from match_matrix import MatchMatrix
 
-stemmer = SnowballStemmer("english")
+# NLTK (WordNet), requests and html2text are only needed for matching
+#  meanings and websites. They are slow to import, so they are imported
+#  when first needed.
+wordnet = None
+
+def get_wordnet():
+    global wordnet
+    if wordnet == None:
+        from nltk.corpus import wordnet as nltk_wordnet
+        wordnet = nltk_wordnet
+    return wordnet
+
+# Word tokens within strings. Underscores and full stops separate tokens.
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+# Maximum number of tokens on either side of a keyword used as its context
+#  for disambiguation.
+MEANING_CONTEXT_SIZE = 20
+
+# Bump when the layout of the compiled keyword snapshot changes.
+KEYWORD_SNAPSHOT_VERSION = 2
+# Bump whenever the output of compute_text_matches or get_single_word_matches
+#  changes for the same text and database, so that results persisted in the
+#  match memo by earlier versions of the matching code are discarded.
+# Version 2: blacklist suppression in strings (all occurrences considered).
+# Version 3: regex tokens and simplified Lesk for meanings.
+MATCH_LOGIC_VERSION = 3
+# Maximum number of cached single word results (one per distinct
+#  set of keywords found).
+SINGLE_WORD_CACHE_SIZE = 100000
 
 
 class CategoryAnalyser:
@@ -17,16 +44,152 @@ class CategoryAnalyser:
     This file can be imported to deal with text related tasks, including getting meaning out of them.
     """
 
-    def __init__(self, basepath):
+    def __init__(self, basepath, match_memo_size=DEFAULT_MATCH_MEMO_SIZE, path_to_match_memo=None):
         super().__init__()
         path_to_categories = os.path.join(
             basepath,
             'resources/common/functional_categories_database.json'
         )
-        with open(path_to_categories) as json_data:
-            self.category_keywords = json.load(json_data)
-        self.html_converter = html2text.HTML2Text()   
-        self.html_converter.ignore_links = True    
+        with open(path_to_categories, 'rb') as json_data:
+            raw_categories = json_data.read()
+        database_hash = hashlib.sha256(raw_categories).hexdigest()
+        self.html_converter = None
+        # WordNet synset signatures per keyword, for disambiguating meanings.
+        self.synset_signatures = {}
+        
+        # The compiled database is snapshotted next to the database file,
+        #  and is recompiled whenever the database changes.
+        self.path_to_snapshot = os.path.splitext(path_to_categories)[0] + '.snapshot.pickle'
+        if self.load_snapshot(database_hash) == False:
+            self.category_keywords = json.loads(raw_categories)
+            self.compile_keywords()
+            self.save_snapshot(database_hash)
+        
+        # Single word results, keyed on the keywords found in the word.
+        self.single_word_results = MatchMemo(None, SINGLE_WORD_CACHE_SIZE)
+        
+        # Memoised match_text results. These depend on the database contents
+        #  and on the matching code, so the memo is tied to a hash of both
+        #  the database file and the matching logic version.
+        self.match_memo = None
+        if match_memo_size > 0:
+            memo_fingerprint = hashlib.sha256(
+                (str(MATCH_LOGIC_VERSION) + ':' + database_hash).encode('utf-8')
+            ).hexdigest()
+            self.match_memo = MatchMemo(
+                memo_fingerprint,
+                match_memo_size,
+                path_to_match_memo
+            )
+    
+    def compile_keywords(self):
+        """Flattens the keyword database into a list of entries (in database order)
+        and builds a single matcher over all keywords, joined child phrases and blacklist terms.
+        """
+        self.keyword_entries = []
+        self.keyword_entry_index = {}
+        # Distinct category_subcategory values, in database order.
+        #  These are the columns of the matrices returned by match_texts.
+        self.category_subcategories = []
+        self.category_subcategory_ids = {}
+        all_patterns = set()
+        for category in self.category_keywords:
+            for sub_category in self.category_keywords[category]:
+                for word in self.category_keywords[category][sub_category]:
+                    word_children = self.get_all_children(category,sub_category,word)
+                    keyword_info = self.category_keywords[category][sub_category][word]
+                    # Joined child phrases, in the order match_text checks them.
+                    word_joins = []
+                    string_joins = []
+                    for next_word in word_children:
+                        direct_joined_w = ''.join(next_word)
+                        space_joined_w = ' '.join(next_word)
+                        hyphen_joined_w = '-'.join(next_word)
+                        uscore_joined_w = '_'.join(next_word)
+                        word_joins.extend([direct_joined_w, hyphen_joined_w, uscore_joined_w])
+                        string_joins.extend([direct_joined_w, space_joined_w, hyphen_joined_w, uscore_joined_w])
+                    entry = {
+                        'category': category,
+                        'sub-category': sub_category,
+                        'category_subcategory': category+':'+sub_category,
+                        'word': word,
+                        'children': word_children,
+                        'blacklist': keyword_info['blacklist'],
+                        'meaning': keyword_info['meaning'],
+                        'word_joins': word_joins,
+                        'string_joins': string_joins
+                    }
+                    if word not in self.keyword_entry_index:
+                        self.keyword_entry_index[word] = []
+                    self.keyword_entry_index[word].append(len(self.keyword_entries))
+                    self.keyword_entries.append(entry)
+                    if entry['category_subcategory'] not in self.category_subcategory_ids:
+                        self.category_subcategory_ids[entry['category_subcategory']] = \
+                            len(self.category_subcategories)
+                        self.category_subcategories.append(entry['category_subcategory'])
+                    all_patterns.add(word)
+                    all_patterns.update(word_joins)
+                    all_patterns.update(string_joins)
+                    all_patterns.update(keyword_info['blacklist'])
+        self.keyword_matcher = KeywordMatcher(sorted(all_patterns))
+
+    def load_snapshot(self, database_hash):
+        """Loads the compiled database from its snapshot. Returns False if there is
+        no snapshot, or it is from a different database (or snapshot version)."""
+        if not os.path.isfile(self.path_to_snapshot):
+            return False
+        try:
+            with open(self.path_to_snapshot, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            return False
+        if snapshot.get('version') != KEYWORD_SNAPSHOT_VERSION:
+            return False
+        if snapshot.get('database_hash') != database_hash:
+            return False
+        self.category_keywords = snapshot['category_keywords']
+        self.keyword_entries = snapshot['keyword_entries']
+        self.keyword_entry_index = snapshot['keyword_entry_index']
+        self.category_subcategories = snapshot['category_subcategories']
+        self.category_subcategory_ids = snapshot['category_subcategory_ids']
+        self.keyword_matcher = snapshot['keyword_matcher']
+        return True
+
+    def save_snapshot(self, database_hash):
+        snapshot = {
+            'version': KEYWORD_SNAPSHOT_VERSION,
+            'database_hash': database_hash,
+            'category_keywords': self.category_keywords,
+            'keyword_entries': self.keyword_entries,
+            'keyword_entry_index': self.keyword_entry_index,
+            'category_subcategories': self.category_subcategories,
+            'category_subcategory_ids': self.category_subcategory_ids,
+            'keyword_matcher': self.keyword_matcher
+        }
+        # The snapshot is only an optimisation, so failing to write it 
+        #  (e.g., on a read-only checkout) is not an error.
+        tmp_path = self.path_to_snapshot + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path_to_snapshot)
+        except OSError:
+            pass
+
+    def get_matched_entries(self, found_keywords):
+        """Returns the keyword entries whose keyword is in found_keywords, in database order."""
+        entry_indices = []
+        for keyword in found_keywords:
+            if keyword in self.keyword_entry_index:
+                entry_indices.extend(self.keyword_entry_index[keyword])
+        entry_indices.sort()
+        return [self.keyword_entries[entry_index] for entry_index in entry_indices]
+
+    def add_match(self, matches, entry, word):
+        matches['category'].append(entry['category'])
+        matches['sub-category'].append(entry['sub-category'])
+        matches['category_subcategory'].append(entry['category_subcategory'])
+        matches['words'].append(word)
     
     def get_all_children(self,cat,sub_cat,word):
         if cat not in self.category_keywords:
@@ -47,11 +210,128 @@ class CategoryAnalyser:
 
     def match_text(self,text,match_meanings=False,single_word=False):
         """Matches a text with the functionality categories.
+        Results are memoised on (text, single_word, match_meanings).
         
         Keyword arguments:
         text -- The text to match
         Return: return_description
         """
+        if self.match_memo == None:
+            return self.compute_text_matches(text, match_meanings, single_word)
+        memoised = self.get_memoised_matches(text, match_meanings, single_word)
+        matches = {}
+        matches['category'] = list(memoised[0])
+        matches['sub-category'] = list(memoised[1])
+        matches['category_subcategory'] = list(memoised[2])
+        matches['words'] = list(memoised[3])
+        return matches
+
+    def get_memoised_matches(self,text,match_meanings=False,single_word=False):
+        """Returns the matches for a text as a tuple of (category, sub-category,
+        category_subcategory, words) tuples, computing and memoising them on a miss."""
+        memo_key = (text, single_word, match_meanings)
+        memoised = self.match_memo.get(memo_key)
+        if (memoised == None) and (single_word == True):
+            memoised = self.get_single_word_matches(text)
+            self.match_memo.put(memo_key, memoised)
+        elif memoised == None:
+            matches = self.compute_text_matches(text, match_meanings, single_word)
+            # Stored as tuples, so that callers can't modify memoised results.
+            memoised = (
+                tuple(matches['category']),
+                tuple(matches['sub-category']),
+                tuple(matches['category_subcategory']),
+                tuple(matches['words'])
+            )
+            self.match_memo.put(memo_key, memoised)
+        return memoised
+
+    def match_texts(self,texts,match_meanings=False,single_word=False):
+        """Matches a batch of texts with the functionality categories.
+        Each distinct text is matched once.
+        
+        Keyword arguments:
+        texts -- The texts to match
+        Return: a MatchMatrix with one row per text, in order, whose columns
+        are self.category_subcategories
+        """
+        match_matrix = MatchMatrix(self.category_subcategories)
+        obj_rows = {}
+        for text in texts:
+            if text not in obj_rows:
+                if (self.match_memo == None) and (single_word == True):
+                    single_word_matches = self.get_single_word_matches(text)
+                    category_subcategories = single_word_matches[2]
+                    words = single_word_matches[3]
+                elif self.match_memo == None:
+                    matches = self.compute_text_matches(text, match_meanings, single_word)
+                    category_subcategories = matches['category_subcategory']
+                    words = matches['words']
+                else:
+                    memoised = self.get_memoised_matches(text, match_meanings, single_word)
+                    category_subcategories = memoised[2]
+                    words = memoised[3]
+                obj_rows[text] = (
+                    [self.category_subcategory_ids[c] for c in category_subcategories],
+                    [match_matrix.fn_get_word_id(word) for word in words]
+                )
+            column_ids, word_ids = obj_rows[text]
+            match_matrix.fn_add_row(column_ids, word_ids)
+        return match_matrix
+
+    def save_match_memo(self):
+        if self.match_memo != None:
+            self.match_memo.save()
+
+    def get_single_word_matches(self,text):
+        """Fast path for matching single words, such as API names and fields.
+        Returns a tuple of (category, sub-category, category_subcategory, words) tuples.
+        A single word's matches depend only on which keywords occur in it,
+        so they are computed once per distinct set of keywords found."""
+        found_keywords = frozenset(self.keyword_matcher.find_keywords(text.lower()))
+        single_word_matches = self.single_word_results.get(found_keywords)
+        if single_word_matches != None:
+            return single_word_matches
+        
+        matches = {}
+        matches['category']= []
+        matches['sub-category']= []
+        matches['category_subcategory']= []
+        matches['words']= []
+        for entry in self.get_matched_entries(found_keywords):
+            if len(entry['children'])>0:
+                for joined_w in entry['word_joins']:
+                    if joined_w in found_keywords:
+                        self.add_match(matches, entry, joined_w)
+            else:
+                # check blacklist
+                no_blacklist = True
+                for blacklist_word in entry['blacklist']:
+                    if blacklist_word in found_keywords:
+                        no_blacklist = False
+                        break
+                if no_blacklist == True:
+                    self.add_match(matches, entry, entry['word'])
+        single_word_matches = (
+            tuple(matches['category']),
+            tuple(matches['sub-category']),
+            tuple(matches['category_subcategory']),
+            tuple(matches['words'])
+        )
+        self.single_word_results.put(found_keywords, single_word_matches)
+        return single_word_matches
+
+    def compute_text_matches(self,text,match_meanings=False,single_word=False):
+        # Single words (API names, fields) have a dedicated fast path.
+        if single_word == True:
+            single_word_matches = self.get_single_word_matches(text)
+            matches = {}
+            matches['category'] = list(single_word_matches[0])
+            matches['sub-category'] = list(single_word_matches[1])
+            matches['category_subcategory'] = list(single_word_matches[2])
+            matches['words'] = list(single_word_matches[3])
+            return matches
+            
         text = text.lower()
         
         # Output object.
@@ -61,126 +341,137 @@ class CategoryAnalyser:
         matches['category_subcategory']= []
         matches['words']= []
         
-        # If text is to be considered a string (not a word).
-        if single_word == False:
-            word_tokens = word_tokenize(text)
-            try:
-                # Split on underscore
-                split_tokens = [split_token for split_token in (word_token.split('_') for word_token in word_tokens)]
-                flat_tokens = [item for sublist in split_tokens for item in sublist]
-                # Split on .
-                second_split_tokens = [split_token for split_token in (word_token.split('.') for word_token in flat_tokens)]
-                tokens = [item for sublist in second_split_tokens for item in sublist]
-            except Exception as e:
-                print(e)
-            stemmed_tokens = [stemmer.stem(element) for element in tokens]
-            # If the text is too short we just do a simple keyword search
-            if len(tokens) < 10:
-                match_meanings = False
+        # The text is to be considered a string (not a word).
+        #  Tokens are only needed for disambiguating meanings, so they are
+        #  found once, along with their start offsets within the text.
+        token_spans = [(m.start(), m.group()) for m in TOKEN_PATTERN.finditer(text)]
+        # If the text is too short we just do a simple keyword search
+        if len(token_spans) < 10:
+            match_meanings = False
+        if match_meanings == True:
+            token_starts = [token_start for token_start, _ in token_spans]
+            tokens = [token for _, token in token_spans]
 
-        # Actual test.
-        for category in self.category_keywords:
-            for sub_category in self.category_keywords[category]:
-                for index,word in enumerate(self.category_keywords[category][sub_category]):
-                    # If word is nowhere in input text, no use in continuing?                 
-                    if word not in text:
-                        continue
-                        
-                    # Get children words.
-                    word_children = self.get_all_children(category,sub_category,word)
-                    
-                    # Get blacklist.
-                    black_list = self.category_keywords[category][sub_category][word]['blacklist']
-                    
-                    # Handle API/fields.
-                    if (single_word == True):
-                        if len(word_children)>0:
-                            for next_word in word_children:
-                                direct_joined_w = ''.join(next_word)
-                                hyphen_joined_w = '-'.join(next_word)
-                                uscore_joined_w = '_'.join(next_word)
-                                for joined_w in [direct_joined_w, hyphen_joined_w, uscore_joined_w]:
-                                    if joined_w in text:
-                                        matches['category'].append(category)
-                                        matches['sub-category'].append(sub_category)
-                                        matches['category_subcategory'].append(category+':'+sub_category)
-                                        matches['words'].append(joined_w)
-                        else:
-                            # check blacklist
-                            no_blacklist = True
-                            if len(black_list) > 0:
-                                for blacklist_word in black_list:
-                                    if blacklist_word in text:
-                                        no_blacklist = False
-                                        continue
-                            if no_blacklist == True:
-                                matches['category'].append(category)
-                                matches['sub-category'].append(sub_category)
-                                matches['category_subcategory'].append(category+':'+sub_category)
-                                matches['words'].append(word) 
-                    # Handle strings.
-                    else:
-                        # See if the words have children.
-                        if len(word_children)>0:
-                            for next_word in word_children:
-                                direct_joined_w = ''.join(next_word)
-                                space_joined_w = ' '.join(next_word)
-                                hyphen_joined_w = '-'.join(next_word)
-                                uscore_joined_w = '_'.join(next_word)
-                                for joined_w in [direct_joined_w, space_joined_w, hyphen_joined_w, uscore_joined_w]:
-                                    if joined_w in text:
-                                        matches['category'].append(category)
-                                        matches['sub-category'].append(sub_category)
-                                        matches['category_subcategory'].append(category+':'+sub_category)
-                                        matches['words'].append(joined_w)
-                        else:
-                            # Find the location(s) of the word within text.
-                            all_indices = self.findall(text, word)
-                            
-                            if len(black_list) > 0:
-                                for single_index in all_indices:
-                                    for blacklist_word in black_list:
-                                        len_word = len(word)
-                                        len_blacklist_word = len(blacklist_word)
-                                        lower_boundary = single_index - len_blacklist_word
-                                        if lower_boundary < 0:
-                                            lower_boundary = 0
-                                        upper_boundary = single_index + len_word + len_blacklist_word
-                                        if upper_boundary > (len(text)-1):
-                                            upper_boundary = len(text) - 1
-                                        text_of_interest = text[lower_boundary: upper_boundary]
-                                        if blacklist_word in text_of_interest:
-                                            try:
-                                                all_indices.remove(single_index)
-                                            except:
-                                                break
-                                                
-                            if len(all_indices) == 0:
-                                continue
+        # Find all keywords, joined child phrases and blacklist terms
+        #  with a single scan over the text.
+        keyword_occurrences = self.keyword_matcher.find_occurrences(text)
+        found_keywords = keyword_occurrences
+
+        # Actual test. Only keywords present in the text are considered.
+        for entry in self.get_matched_entries(found_keywords):
+            word = entry['word']
+            
+            # Get children words.
+            word_children = entry['children']
+            
+            # Get blacklist.
+            black_list = entry['blacklist']
+            
+            # See if the words have children.
+            if len(word_children)>0:
+                for joined_w in entry['string_joins']:
+                    if joined_w in found_keywords:
+                        self.add_match(matches, entry, joined_w)
+            else:
+                # Location(s) of the word within text, excluding those
+                #  with a blacklisted word nearby.
+                all_indices = self.get_unblacklisted_indices(
+                    word,
+                    keyword_occurrences[word],
+                    black_list,
+                    keyword_occurrences
+                )
 
-                            if match_meanings == True:
-                                meanings = self.category_keywords[category][sub_category][word]['meaning']
-                                if len(meanings)>0:
-                                    for token_index in token_indices:
-                                        boundary = min([20,token_index,len(tokens)-token_index])
-                                        meaning = lesk(tokens[token_index-boundary:token_index+boundary], word)            
-                                        if meaning is not None and meaning.name() in meanings:
-                                            matches['category'].append(category)
-                                            matches['sub-category'].append(sub_category)
-                                            matches['category_subcategory'].append(category+':'+sub_category)   
-                                            matches['words'].append(word)
-                                else:
-                                    matches['category'].append(category)
-                                    matches['sub-category'].append(sub_category)
-                                    matches['category_subcategory'].append(category+':'+sub_category)   
-                                    matches['words'].append(word) 
-                            else:
-                                matches['category'].append(category)
-                                matches['sub-category'].append(sub_category)  
-                                matches['category_subcategory'].append(category+':'+sub_category)                            
-                                matches['words'].append(word)
+                if len(all_indices) == 0:
+                    continue
+
+                if match_meanings == True:
+                    meanings = entry['meaning']
+                    if len(meanings)>0:
+                        for token_index in self.get_token_indices(token_starts, all_indices):
+                            meaning = self.disambiguate(tokens, token_index, word)
+                            if meaning is not None and meaning in meanings:
+                                self.add_match(matches, entry, word)
+                    else:
+                        self.add_match(matches, entry, word)
+                else:
+                    self.add_match(matches, entry, word)
         return matches
 
+    def get_token_indices(self, token_starts, char_indices):
+        """Returns the distinct indices of the tokens containing
+        the given (ascending) character offsets, in order."""
+        token_indices = []
+        for char_index in char_indices:
+            token_index = max(bisect_right(token_starts, char_index) - 1, 0)
+            if (len(token_indices) == 0) or (token_indices[-1] != token_index):
+                token_indices.append(token_index)
+        return token_indices
+
+    def get_synset_signatures(self, word):
+        """Returns (synset name, set of definition words) for each WordNet
+        synset of word. These are computed once per word."""
+        if word not in self.synset_signatures:
+            self.synset_signatures[word] = [
+                (synset.name(), frozenset(synset.definition().split()))
+                for synset in get_wordnet().synsets(word)
+            ]
+        return self.synset_signatures[word]
+
+    def disambiguate(self, tokens, token_index, word):
+        """Returns the name of the most likely WordNet synset of word, given
+        the tokens around tokens[token_index], or None if word has no synsets.
+        This is the simplified Lesk algorithm, as in nltk.wsd.lesk: the synset
+        whose definition shares the most words with the context is chosen,
+        and ties go to the greatest synset name."""
+        signatures = self.get_synset_signatures(word)
+        if len(signatures) == 0:
+            return None
+        boundary = min([MEANING_CONTEXT_SIZE, token_index, len(tokens)-token_index])
+        context = set(tokens[token_index-boundary:token_index+boundary])
+        best = max(
+            (len(context.intersection(definition_words)), synset_name)
+            for synset_name, definition_words in signatures
+        )
+        return best[1]
+
+    def get_unblacklisted_indices(self, word, word_indices, black_list, keyword_occurrences):
+        """Returns the start indices of word that have no blacklisted word
+        within len(blacklist word) characters on either side, i.e., where no
+        blacklisted word falls within
+        text[index - len(blacklist word):index + len(word) + len(blacklist word)].
+        
+        Keyword arguments:
+        word -- The keyword
+        word_indices -- Ascending start indices of word within the text
+        black_list -- Blacklisted words for the keyword
+        keyword_occurrences -- Output of KeywordMatcher.find_occurrences for the text
+        """
+        # Blacklisted words found anywhere in the text. Their occurrences
+        #  come from the same scan as the keyword's, and are in ascending order.
+        blacklist_hits = [
+            (len(blacklist_word), keyword_occurrences[blacklist_word])
+            for blacklist_word in black_list
+            if blacklist_word in keyword_occurrences
+        ]
+        if len(blacklist_hits) == 0:
+            return list(word_indices)
+        len_word = len(word)
+        unblacklisted_indices = []
+        for single_index in word_indices:
+            is_blacklisted = False
+            for len_blacklist_word, blacklist_indices in blacklist_hits:
+                # The first occurrence starting at or after the window start
+                #  is within the window if it also ends within it.
+                position = bisect_left(blacklist_indices, single_index - len_blacklist_word)
+                if (position < len(blacklist_indices)) and \
+                        (blacklist_indices[position] <= single_index + len_word):
+                    is_blacklisted = True
+                    break
+            if is_blacklisted == False:
+                unblacklisted_indices.append(single_index)
+        return unblacklisted_indices
+
     def findall(self, string, substring):
         all_indices = []
         i = string.find(substring)
@@ -249,8 +540,16 @@ class CategoryAnalyser:
                         matches['category_subcategory'].append(category+':'+sub_category)   
         return matches
 
+    def get_html_converter(self):
+        if self.html_converter == None:
+            import html2text
+            self.html_converter = html2text.HTML2Text()
+            self.html_converter.ignore_links = True
+        return self.html_converter
+
     def check_website(self,url):
+        import requests
         headers = {"Accept-Language": "en-US,en;q=0.5"}
         r = requests.get(url, headers=headers)
-        filtered_text = self.html_converter.handle((r.text)).replace('\n','')
+        filtered_text = self.get_html_converter().handle((r.text)).replace('\n','')
         return self.match_text(filtered_text)
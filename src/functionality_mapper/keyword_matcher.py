@@ -0,0 +1,109 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of keywords.
+    All keywords that occur in a text are found with a single scan of the text,
+    rather than one substring search per keyword.
+    The failure links are resolved into a full transition table once the
+    automaton is built, so that scanning costs one table lookup per character.
+    """
+
+    def __init__(self, keywords):
+        # State 0 is the root. goto holds the trie edges, fail the failure
+        #  links and output the keywords that end at each state.
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        self.transitions = []
+        for keyword in keywords:
+            self.add_keyword(keyword)
+        self.build()
+
+    def add_keyword(self, keyword):
+        if keyword == '':
+            return
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        if keyword not in self.output[state]:
+            self.output[state] = self.output[state] + (keyword,)
+
+    def build(self):
+        # Breadth-first, so that a state's failure target is always
+        #  complete before the state itself is processed.
+        queue = deque(self.goto[0].values())
+        bfs_order = [0]
+        while queue:
+            state = queue.popleft()
+            bfs_order.append(state)
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state != 0 and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                fail_state = self.goto[fail_state].get(char, 0)
+                self.fail[next_state] = fail_state
+                self.output[next_state] = \
+                    self.output[next_state] + self.output[fail_state]
+        self.build_transitions(bfs_order)
+
+    def build_transitions(self, bfs_order):
+        # transitions[state][char] is the state reached on char, following
+        #  failure links as needed. Characters that lead back to the root
+        #  are left out. In breadth-first order, a state's failure target
+        #  already has its transitions.
+        alphabet = set()
+        for edges in self.goto:
+            alphabet.update(edges)
+        self.transitions = [None] * len(self.goto)
+        for state in bfs_order:
+            if state == 0:
+                self.transitions[0] = dict(self.goto[0])
+                continue
+            fail_transitions = self.transitions[self.fail[state]]
+            state_transitions = {}
+            for char in alphabet:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = fail_transitions.get(char, 0)
+                if next_state != 0:
+                    state_transitions[char] = next_state
+            self.transitions[state] = state_transitions
+
+    def find_keywords(self, text):
+        """Returns the set of keywords that occur anywhere in text."""
+        transitions = self.transitions
+        output = self.output
+        found = set()
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def find_occurrences(self, text):
+        """Returns a dict of keyword -> ascending list of start indices,
+        for every (possibly overlapping) occurrence of every keyword in text."""
+        transitions = self.transitions
+        output = self.output
+        occurrences = {}
+        state = 0
+        for index, char in enumerate(text):
+            state = transitions[state].get(char, 0)
+            for keyword in output[state]:
+                start = index - len(keyword) + 1
+                if keyword in occurrences:
+                    occurrences[keyword].append(start)
+                else:
+                    occurrences[keyword] = [start]
+        return occurrences
@@ -0,0 +1,93 @@
+from array import array
+
+
+class MatchMatrix:
+    """
+    Sparse (text x category_subcategory) matrix of match results, as returned
+    by CategoryAnalyser.match_texts. Stored in compressed sparse row form:
+    the hits of row i are hits[indptr[i]:indptr[i+1]], where each hit is
+    a column (category_subcategory) ID in indices, and the ID of the matched
+    word in word_ids. A row can contain the same column more than once,
+    once per matched word, as with match_text.
+    """
+
+    def __init__(self, column_labels):
+        self.column_labels = column_labels
+        self.words = []
+        self.word_index = {}
+        self.indptr = array('L', [0])
+        self.indices = array('L')
+        self.word_ids = array('L')
+
+    def fn_get_word_id(self, word):
+        if word not in self.word_index:
+            self.word_index[word] = len(self.words)
+            self.words.append(word)
+        return self.word_index[word]
+
+    def fn_add_row(self, column_ids, word_ids):
+        self.indices.extend(column_ids)
+        self.word_ids.extend(word_ids)
+        self.indptr.append(len(self.indices))
+
+    def fn_get_num_rows(self):
+        return len(self.indptr) - 1
+
+    def fn_get_row(self, row):
+        """Returns the (category_subcategory, word) hits of a row, in match order."""
+        start = self.indptr[row]
+        end = self.indptr[row + 1]
+        return [
+            (self.column_labels[self.indices[i]], self.words[self.word_ids[i]])
+            for i in range(start, end)
+        ]
+
+    def fn_get_row_categories(self, row):
+        """Returns the distinct category_subcategory values of a row, in match order."""
+        start = self.indptr[row]
+        end = self.indptr[row + 1]
+        column_ids = dict.fromkeys(self.indices[start:end])
+        return [self.column_labels[column_id] for column_id in column_ids]
+
+    def fn_get_distinct_categories_per_row(self):
+        """Returns, for all rows in order, the distinct category_subcategory
+        values of each row, as a single flat list."""
+        categories = []
+        column_labels = self.column_labels
+        indices = self.indices
+        indptr = self.indptr
+        for row in range(len(indptr) - 1):
+            start = indptr[row]
+            end = indptr[row + 1]
+            if start == end:
+                continue
+            if (end - start) == 1:
+                categories.append(column_labels[indices[start]])
+                continue
+            for column_id in dict.fromkeys(indices[start:end]):
+                categories.append(column_labels[column_id])
+        return categories
+
+    def fn_get_column_counts(self):
+        """Returns a dict of category_subcategory -> number of rows that hit it."""
+        counts = {}
+        for row in range(self.fn_get_num_rows()):
+            for category_subcategory in self.fn_get_row_categories(row):
+                counts[category_subcategory] = counts.get(category_subcategory, 0) + 1
+        return counts
+
+    def fn_to_scipy(self):
+        """Returns the matrix as a scipy.sparse.csr_matrix of hit counts.
+        Requires SciPy (and NumPy), which are otherwise not needed."""
+        import numpy
+        from scipy.sparse import csr_matrix
+        matrix = csr_matrix(
+            (
+                numpy.ones(len(self.indices), dtype=numpy.int32),
+                numpy.array(self.indices, dtype=numpy.int64),
+                numpy.array(self.indptr, dtype=numpy.int64)
+            ),
+            shape=(self.fn_get_num_rows(), len(self.column_labels))
+        )
+        matrix.sum_duplicates()
+        return matrix
@@ -0,0 +1,99 @@
+import os
+import pickle
+from collections import OrderedDict
+
+# Bump when the format of stored results changes. Changes to the results
+#  themselves are covered by the fingerprint (see MATCH_LOGIC_VERSION in
+#  category_analysis.py).
+MATCH_MEMO_VERSION = 1
+# Default maximum number of memoised texts.
+DEFAULT_MATCH_MEMO_SIZE = 1000000
+
+
+class MatchMemo:
+    """
+    Content-keyed, least-recently-used store of match_text results.
+    Results are only valid for the keyword database and matching code they
+    were computed with, so the memo carries a fingerprint of both, and a
+    persisted memo with a different fingerprint (or version) is discarded on load.
+    """
+
+    def __init__(self, fingerprint, max_size=DEFAULT_MATCH_MEMO_SIZE, path_to_memo=None):
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.path_to_memo = path_to_memo
+        self.obj_memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Entries put since the last pop_new_entries, if tracked.
+        self.obj_new_entries = None
+        if path_to_memo != None:
+            self.load()
+
+    def get(self, key):
+        if key not in self.obj_memo:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.obj_memo.move_to_end(key)
+        return self.obj_memo[key]
+
+    def put(self, key, value):
+        self.obj_memo[key] = value
+        self.obj_memo.move_to_end(key)
+        while len(self.obj_memo) > self.max_size:
+            self.obj_memo.popitem(last=False)
+        if self.obj_new_entries != None:
+            self.obj_new_entries[key] = value
+
+    def track_new_entries(self):
+        """Starts recording the entries that are put, e.g., so that a worker
+        process can hand its new entries to the process that saves the memo."""
+        self.obj_new_entries = OrderedDict()
+
+    def pop_new_entries(self):
+        """Returns the (key, value) pairs put since the last call, oldest first."""
+        if self.obj_new_entries == None:
+            return []
+        new_entries = list(self.obj_new_entries.items())
+        self.obj_new_entries = OrderedDict()
+        return new_entries
+
+    def load(self):
+        if not os.path.isfile(self.path_to_memo):
+            return
+        try:
+            with open(self.path_to_memo, 'rb') as f:
+                obj_stored = pickle.load(f)
+        except Exception as e:
+            print('Unable to load match memo: ' + str(e))
+            return
+        if obj_stored.get('version') != MATCH_MEMO_VERSION:
+            return
+        if obj_stored.get('fingerprint') != self.fingerprint:
+            return
+        # Stored oldest first, so the LRU order is preserved.
+        for key, value in obj_stored['entries']:
+            self.put(key, value)
+
+    def save(self):
+        if self.path_to_memo == None:
+            return
+        obj_stored = {
+            'version': MATCH_MEMO_VERSION,
+            'fingerprint': self.fingerprint,
+            'entries': list(self.obj_memo.items())
+        }
+        # Write to a temporary file first, so that an interrupted save
+        #  doesn't destroy the previous memo.
+        tmp_path = self.path_to_memo + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj_stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path_to_memo)
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.obj_memo)
+        }
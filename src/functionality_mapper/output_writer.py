@@ -0,0 +1,89 @@
+import os
+import json
+import argparse
+
+# Each line of the JSON Lines output is one APK's record.
+RECORD_APK_KEY = 'apk'
+RECORD_UUIDS_KEY = 'uuids'
+
+
+class JsonlOutputWriter:
+    """
+    Writes functionality mapping output as JSON Lines, one compact record
+    per APK, as soon as the APK has been mapped. Each record is flushed
+    as it is written, so results can be consumed while mapping is still
+    running, and a crash only loses the APK that was in progress.
+    """
+
+    def __init__(self, path_to_output):
+        self.path_to_output = path_to_output
+        self.num_records = 0
+        self.file = open(path_to_output, 'w')
+
+    def fn_write_apk(self, apk, per_apk_output):
+        record = {
+            RECORD_APK_KEY: apk,
+            RECORD_UUIDS_KEY: per_apk_output
+        }
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+        self.num_records += 1
+
+    def fn_close(self):
+        self.file.close()
+
+
+def fn_iter_jsonl_output(path_to_jsonl):
+    """Yields (apk, per_apk_output) pairs from JSON Lines output.
+    An incomplete last line (e.g., from an interrupted run) is skipped."""
+    with open(path_to_jsonl) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            line = line.strip()
+            if line == '':
+                continue
+            record = json.loads(line)
+            yield record[RECORD_APK_KEY], record[RECORD_UUIDS_KEY]
+
+def fn_convert_jsonl_to_json(path_to_jsonl, path_to_json):
+    """Rebuilds the legacy nested apk_matcher_output.json from JSON Lines output.
+    The result is the same as json.dump(obj_output, f, indent=4) would give,
+    but is written one APK at a time."""
+    tmp_path = path_to_json + '.tmp'
+    with open(tmp_path, 'w') as f:
+        is_first = True
+        for apk, per_apk_output in fn_iter_jsonl_output(path_to_jsonl):
+            if is_first == True:
+                f.write('{\n    ')
+                is_first = False
+            else:
+                f.write(',\n    ')
+            # Strings are escaped in JSON, so every newline is indentation.
+            str_apk_output = json.dumps(per_apk_output, indent=4)
+            f.write(
+                json.dumps(apk) + ': '
+                + str_apk_output.replace('\n', '\n    ')
+            )
+        if is_first == True:
+            f.write('{}')
+        else:
+            f.write('\n}')
+    os.replace(tmp_path, path_to_json)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Converts JSON Lines functionality mapping output '
+                      + 'to the nested JSON format.'
+    )
+    argparser.add_argument(
+        'jsonl_file',
+        help = 'JSON Lines output, e.g., apk_matcher_output.jsonl'
+    )
+    argparser.add_argument(
+        'json_file',
+        help = 'nested JSON file to write, e.g., apk_matcher_output.json'
+    )
+    args = argparser.parse_args()
+    fn_convert_jsonl_to_json(args.jsonl_file, args.json_file)
@@ -0,0 +1,74 @@
+import os
+import json
+from packed_artifacts import fn_write_packed_artifacts, SECTION_NAMES
+
+
+class JsonArtifactWriter:
+    """
+    Writes the JSON artifacts of one APK (one file per section), streaming
+    each entry to its file as soon as it has been extracted, rather than
+    building the artifacts in memory first. Files are written to temporary
+    paths, and only moved into place by fn_close.
+    """
+
+    def __init__(self, obj_output_paths):
+        # obj_output_paths is a dict of section name -> output path.
+        self.obj_output_paths = obj_output_paths
+        self.obj_files = {}
+        self.obj_keys = {}
+        for section_name in obj_output_paths:
+            f = open(obj_output_paths[section_name] + '.tmp', 'w')
+            f.write('{')
+            self.obj_files[section_name] = f
+            self.obj_keys[section_name] = set()
+
+    def fn_add(self, section_name, key, values):
+        # A key is only written once. If a class is defined in more than
+        #  one DEX file, the first definition is kept (as at runtime).
+        if key in self.obj_keys[section_name]:
+            return
+        f = self.obj_files[section_name]
+        if len(self.obj_keys[section_name]) > 0:
+            f.write(',')
+        self.obj_keys[section_name].add(key)
+        f.write(json.dumps(key) + ':' + json.dumps(values, separators=(',', ':')))
+
+    def fn_close(self):
+        for section_name in self.obj_files:
+            f = self.obj_files[section_name]
+            f.write('}')
+            f.close()
+            output_path = self.obj_output_paths[section_name]
+            os.replace(output_path + '.tmp', output_path)
+        self.obj_files = {}
+
+    def fn_discard(self):
+        """Abandons the artifacts, e.g., if extraction fails part way."""
+        for section_name in self.obj_files:
+            self.obj_files[section_name].close()
+            os.remove(self.obj_output_paths[section_name] + '.tmp')
+        self.obj_files = {}
+
+
+class PackedArtifactWriter:
+    """
+    Collects the artifacts of one APK, and writes them as a packed file
+    on fn_close. The packed format interns strings across all sections,
+    so the file can only be written once extraction is complete.
+    """
+
+    def __init__(self, path_to_pack):
+        self.path_to_pack = path_to_pack
+        self.obj_sections = {section_name: {} for section_name in SECTION_NAMES}
+
+    def fn_add(self, section_name, key, values):
+        if key in self.obj_sections[section_name]:
+            return
+        self.obj_sections[section_name][key] = values
+
+    def fn_close(self):
+        fn_write_packed_artifacts(self.path_to_pack, self.obj_sections)
+        self.obj_sections = None
+
+    def fn_discard(self):
+        self.obj_sections = None
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+
+# Bump when the manifest layout changes.
+MANIFEST_VERSION = 1
+# How many results to record between checkpoints.
+CHECKPOINT_INTERVAL = 10
+
+
+def fn_hash_file(path_to_file):
+    sha = hashlib.sha256()
+    with open(path_to_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def fn_hash_methods(methods):
+    """Returns a hash of a set of method signatures (in any order)."""
+    sha = hashlib.sha256()
+    for method in sorted(set(methods)):
+        sha.update(method.encode('utf-8') + b'\n')
+    return sha.hexdigest()
+
+
+class ExtractionManifest:
+    """
+    Records, per APK, the state of its artifact extraction:
+    the APK's hash, size and mtime, the extractor version that was used,
+    the artifact paths that were produced, and the outcome.
+    For targeted extraction, it also records a hash of the APK's
+    target methods, so that only APKs whose methods change are re-extracted.
+    This allows extraction to skip APKs whose artifacts are up to date,
+    retry those that failed, and resume after a crash.
+    """
+
+    def __init__(self, path_to_manifest, extractor_version, max_attempts=3):
+        self.path_to_manifest = path_to_manifest
+        self.extractor_version = extractor_version
+        self.max_attempts = max_attempts
+        self.obj_apks = {}
+        self.num_unsaved = 0
+        self.fn_load()
+
+    def fn_load(self):
+        if not os.path.isfile(self.path_to_manifest):
+            return
+        with open(self.path_to_manifest) as f:
+            obj_manifest = json.load(f)
+        if obj_manifest.get('version') != MANIFEST_VERSION:
+            return
+        self.obj_apks = obj_manifest['apks']
+
+    def fn_save(self):
+        obj_manifest = {
+            'version': MANIFEST_VERSION,
+            'apks': self.obj_apks
+        }
+        # Write to a temporary file first, so that a crash mid-write
+        #  doesn't lose the previous checkpoint.
+        tmp_path = self.path_to_manifest + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(obj_manifest, f, indent=4)
+        os.replace(tmp_path, self.path_to_manifest)
+        self.num_unsaved = 0
+
+    def fn_needs_extraction(self, path_to_apk, output_paths, targets_hash=None):
+        """Returns True if the APK has not been (successfully) extracted
+        with the current extractor version, or if it, its artifacts
+        or (for targeted extraction) its target methods have changed."""
+        if path_to_apk not in self.obj_apks:
+            return True
+        apk_entry = self.obj_apks[path_to_apk]
+        # A new extractor version (or artifact format or mode) may succeed
+        #  where the previous one failed, so this is checked first.
+        if apk_entry['extractor_version'] != self.extractor_version:
+            return True
+        if apk_entry['status'] != 'done':
+            if apk_entry['attempts'] < self.max_attempts:
+                return True
+            # Give up on APKs that keep failing, unless they have since changed.
+            return self.fn_is_apk_changed(path_to_apk, apk_entry)
+        if apk_entry.get('targets_hash') != targets_hash:
+            return True
+        if sorted(apk_entry['outputs']) != sorted(output_paths):
+            return True
+        for output_path in output_paths:
+            if not os.path.isfile(output_path):
+                return True
+        return self.fn_is_apk_changed(path_to_apk, apk_entry)
+
+    def fn_is_apk_changed(self, path_to_apk, apk_entry):
+        if not os.path.isfile(path_to_apk):
+            return False
+        apk_stat = os.stat(path_to_apk)
+        if (apk_stat.st_size == apk_entry['size']) and (apk_stat.st_mtime == apk_entry['mtime']):
+            return False
+        # Size/mtime changed. The content may not have (e.g., if the APK was copied).
+        if fn_hash_file(path_to_apk) != apk_entry['sha256']:
+            return True
+        apk_entry['size'] = apk_stat.st_size
+        apk_entry['mtime'] = apk_stat.st_mtime
+        self.num_unsaved += 1
+        return False
+
+    def fn_record(self, path_to_apk, status, output_paths, targets_hash=None):
+        """Records the outcome of an extraction, checkpointing periodically."""
+        apk_entry = self.obj_apks.get(path_to_apk, {'attempts': 0})
+        # Attempts are counted per extractor version.
+        if apk_entry.get('extractor_version') != self.extractor_version:
+            apk_entry['attempts'] = 0
+        if status == 'done':
+            apk_entry['attempts'] = 0
+        else:
+            apk_entry['attempts'] += 1
+        apk_entry['status'] = status
+        apk_entry['extractor_version'] = self.extractor_version
+        apk_entry['outputs'] = output_paths
+        apk_entry['targets_hash'] = targets_hash
+        if os.path.isfile(path_to_apk):
+            apk_stat = os.stat(path_to_apk)
+            apk_entry['size'] = apk_stat.st_size
+            apk_entry['mtime'] = apk_stat.st_mtime
+            apk_entry['sha256'] = fn_hash_file(path_to_apk)
+        else:
+            apk_entry['size'] = None
+            apk_entry['mtime'] = None
+            apk_entry['sha256'] = None
+        self.obj_apks[path_to_apk] = apk_entry
+        self.num_unsaved += 1
+        if self.num_unsaved >= CHECKPOINT_INTERVAL:
+            self.fn_save()
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+
+# Task outcomes.
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+STATUS_MEMORY = 'memory'
+STATUS_CRASHED = 'crashed'
+
+# How often (in seconds) the supervisor checks on running tasks.
+POLL_INTERVAL = 1
+
+
+def fn_get_rss_bytes(pid):
+    """Returns the current resident set size of a process, or None if unavailable."""
+    try:
+        with open('/proc/' + str(pid) + '/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+def fn_extraction_worker(basepath, utils_dir, artifact_format, extraction_mode, conn):
+    """Worker loop. Extracts one APK per (APK path, target methods) request
+    received on conn, until a None request (or a closed connection)
+    tells it to exit."""
+    sys.path.append(utils_dir)
+    from strings_fields_extractor import StringsFieldsExtractor
+    sf_extractor = StringsFieldsExtractor(basepath, artifact_format, extraction_mode)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task == None:
+            break
+        path_to_apk, target_methods = task
+        try:
+            is_extracted = sf_extractor.fn_extract_fields_and_strings(
+                path_to_apk,
+                target_methods
+            )
+            error = None
+        except Exception as e:
+            is_extracted = False
+            error = str(e)
+        conn.send((is_extracted, error, fn_get_rss_bytes(os.getpid())))
+    conn.close()
+
+
+class ExtractionPool:
+    """
+    Supervises a pool of Androguard extraction worker processes.
+    Workers are handed one APK at a time. A worker is replaced (recycled)
+    after max_apks_per_worker APKs, or once its RSS exceeds max_rss_bytes.
+    A task that runs for longer than timeout seconds, or pushes its worker
+    past max_rss_bytes while running, is killed along with its worker.
+    """
+
+    def __init__(self, basepath, utils_dir, num_workers=1, max_apks_per_worker=50,
+                 max_rss_bytes=None, timeout=None, artifact_format='json',
+                 extraction_mode='full'):
+        self.base_dir = basepath
+        self.utils_dir = utils_dir
+        self.artifact_format = artifact_format
+        self.extraction_mode = extraction_mode
+        self.num_workers = num_workers
+        self.max_apks_per_worker = max_apks_per_worker
+        self.max_rss_bytes = max_rss_bytes
+        self.timeout = timeout
+        self.workers = []
+
+    def fn_extract_all(self, apk_list, fn_on_result=None, obj_target_methods=None):
+        """Extracts every APK in apk_list. Returns a dict of APK path -> status.
+        If given, fn_on_result(path_to_apk, status) is called as each APK completes.
+        If given, obj_target_methods (APK path -> methods) limits extraction
+        to the listed methods of each APK."""
+        self.obj_target_methods = obj_target_methods
+        obj_status = {}
+        pending = list(reversed(apk_list))
+        try:
+            while pending or self.fn_get_busy_workers():
+                # Hand out work to idle workers, starting new ones as needed.
+                while pending and (len(self.workers) < self.num_workers):
+                    self.fn_start_worker()
+                for worker in self.workers:
+                    if (worker['task'] == None) and pending:
+                        self.fn_assign_task(worker, pending.pop())
+
+                # Wait for results.
+                busy_conns = [w['conn'] for w in self.fn_get_busy_workers()]
+                ready_conns = wait(busy_conns, timeout=POLL_INTERVAL)
+                for worker in list(self.workers):
+                    if worker['task'] == None:
+                        continue
+                    if worker['conn'] in ready_conns:
+                        path_to_apk, status = self.fn_collect_result(worker)
+                    else:
+                        path_to_apk, status = self.fn_check_running_task(worker)
+                    if status == None:
+                        continue
+                    obj_status[path_to_apk] = status
+                    if fn_on_result != None:
+                        fn_on_result(path_to_apk, status)
+        finally:
+            for worker in list(self.workers):
+                self.fn_stop_worker(worker)
+        return obj_status
+
+    def fn_get_busy_workers(self):
+        return [w for w in self.workers if w['task'] != None]
+
+    def fn_start_worker(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=fn_extraction_worker,
+            args=(
+                self.base_dir,
+                self.utils_dir,
+                self.artifact_format,
+                self.extraction_mode,
+                child_conn
+            ),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = {
+            'process': process,
+            'conn': parent_conn,
+            'task': None,
+            'task_start': None,
+            'num_apks': 0
+        }
+        self.workers.append(worker)
+        return worker
+
+    def fn_stop_worker(self, worker, kill=False):
+        if kill == True:
+            worker['process'].kill()
+        else:
+            try:
+                worker['conn'].send(None)
+            except (OSError, ValueError):
+                pass
+        worker['process'].join()
+        worker['conn'].close()
+        self.workers.remove(worker)
+
+    def fn_assign_task(self, worker, path_to_apk):
+        worker['task'] = path_to_apk
+        worker['task_start'] = time.monotonic()
+        target_methods = None
+        if self.obj_target_methods != None:
+            target_methods = self.obj_target_methods[path_to_apk]
+        worker['conn'].send((path_to_apk, target_methods))
+
+    def fn_collect_result(self, worker):
+        path_to_apk = worker['task']
+        try:
+            is_extracted, error, rss_bytes = worker['conn'].recv()
+        except (EOFError, OSError):
+            # The worker died mid-task (e.g., killed by the OOM killer).
+            self.fn_stop_worker(worker, kill=True)
+            print('Worker crashed while extracting ' + path_to_apk)
+            return path_to_apk, STATUS_CRASHED
+        worker['task'] = None
+        worker['num_apks'] += 1
+        if error != None:
+            print('Error extracting ' + path_to_apk + ': ' + error)
+        status = STATUS_DONE if is_extracted == True else STATUS_FAILED
+
+        # Recycle workers that have done their share, or grown too large.
+        if worker['num_apks'] >= self.max_apks_per_worker:
+            self.fn_stop_worker(worker)
+        elif (self.max_rss_bytes != None) and (rss_bytes != None) \
+                and (rss_bytes > self.max_rss_bytes):
+            self.fn_stop_worker(worker)
+        return path_to_apk, status
+
+    def fn_check_running_task(self, worker):
+        path_to_apk = worker['task']
+        if not worker['process'].is_alive():
+            self.fn_stop_worker(worker, kill=True)
+            print('Worker crashed while extracting ' + path_to_apk)
+            return path_to_apk, STATUS_CRASHED
+        if self.timeout != None:
+            if (time.monotonic() - worker['task_start']) > self.timeout:
+                self.fn_stop_worker(worker, kill=True)
+                print('Timed out extracting ' + path_to_apk)
+                return path_to_apk, STATUS_TIMEOUT
+        if self.max_rss_bytes != None:
+            rss_bytes = fn_get_rss_bytes(worker['process'].pid)
+            if (rss_bytes != None) and (rss_bytes > self.max_rss_bytes):
+                self.fn_stop_worker(worker, kill=True)
+                print('Memory ceiling exceeded extracting ' + path_to_apk)
+                return path_to_apk, STATUS_MEMORY
+        return path_to_apk, None
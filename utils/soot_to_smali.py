@@ -1,37 +1,135 @@
+import os
+import sys
 import json
+import argparse
+import itertools
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..',
+    'src',
+    'common'
+)))
+from extractor_reader import ExtractorOutputReader
+
+# Maximum number of memoised method conversions. The same (e.g., SDK)
+#  methods recur across APKs, so most conversions are repeats.
+DEFAULT_MEMO_SIZE = 1000000
+# Number of APK records handed to the worker pool at a time, so that
+#  the input is not read (far) ahead of the output being written.
+POOL_WINDOW_SIZE = 256
 
 
 class SootToSmali:
-    def __init__(self):
-        pass
-        
-    def convert_soot_json_to_smali(self, path_to_json, path_to_out_json):
-        with open(path_to_json) as infile:
-            in_uuids = json.load(infile)
-        for apk in in_uuids:
-            for uuid in in_uuids[apk]['uuids']:
-                all_methods = []
-                for method in in_uuids[apk]['uuids'][uuid]['methods']:
-                    smali_method = self.convert_soot_method_to_smali(method)
-                    if smali_method not in all_methods:
-                        all_methods.append(smali_method)
-                in_uuids[apk]['uuids'][uuid]['methods'] = all_methods
-        with open(path_to_out_json, 'w') as outfile:
-           json.dump(in_uuids, outfile, indent=4)
-    
+    def __init__(self, memo_size=DEFAULT_MEMO_SIZE):
+        self.memo_size = memo_size
+        self.obj_smali_methods = {}
+
+    def convert_soot_json_to_smali(self, path_to_json, path_to_out_json, num_workers=1):
+        """Converts the methods in a Soot-format extractor output file to smali.
+        APK records are read, converted and written one at a time, so the
+        whole file is never held in memory. With num_workers > 1, records
+        are converted by a pool of processes. Output is in input order."""
+        reader = ExtractorOutputReader(path_to_json)
+        tmp_path = path_to_out_json + '.tmp'
+        with open(tmp_path, 'w') as outfile:
+            outfile.write('{')
+            is_first = True
+            for apk, apk_obj in self.fn_iter_converted(reader, num_workers):
+                if is_first == False:
+                    outfile.write(',\n')
+                is_first = False
+                outfile.write(
+                    json.dumps(apk) + ':'
+                    + json.dumps(apk_obj, separators=(',', ':'))
+                )
+            outfile.write('}\n')
+        os.replace(tmp_path, path_to_out_json)
+
+    def fn_iter_converted(self, reader, num_workers):
+        if num_workers <= 1:
+            for apk, apk_obj in reader.fn_iter_items():
+                yield apk, self.convert_apk_obj(apk_obj)
+            return
+        items = reader.fn_iter_items()
+        with multiprocessing.Pool(num_workers, fn_initialise_worker, (self.memo_size,)) as pool:
+            while True:
+                window = list(itertools.islice(items, POOL_WINDOW_SIZE))
+                if len(window) == 0:
+                    break
+                for item in pool.imap(fn_convert_item, window, chunksize=16):
+                    yield item
+
+    def convert_apk_obj(self, apk_obj):
+        for uuid in apk_obj['uuids']:
+            # Dedupe, keeping the first occurrence of each method.
+            all_methods = dict.fromkeys(
+                self.convert_soot_method_to_smali(method)
+                for method in apk_obj['uuids'][uuid]['methods']
+            )
+            apk_obj['uuids'][uuid]['methods'] = list(all_methods)
+        return apk_obj
+
     def convert_soot_method_to_smali(self, java_method):
-        # Remove leading "<".
-        java_method = java_method[1:]
+        if java_method in self.obj_smali_methods:
+            return self.obj_smali_methods[java_method]
+        # Remove leading "<", and split into class, return type and
+        #  method (with partial descriptor). The rest is not needed.
+        java_method_parts = java_method[1:].split(' ', 3)
         # Class part is initial bit. Get rid of trailing ":"
-        java_class = (java_method.split(' ')[0]).replace(':', '')
+        java_class = java_method_parts[0].replace(':', '')
         # Convert class part to smali.
         smali_class = 'L' + java_class.replace('.', '/') + ';'
         # Method and partial descriptor are the 3rd component when splitting by space.
-        java_method_desc = java_method.split(' ')[2]
+        java_method_desc = java_method_parts[2]
         # We only want the method, not descriptor.
         java_method_part = java_method_desc.split('(')[0]
         # Combine class and method parts.
         smali_method = smali_class + '->' + java_method_part
+
+        if len(self.obj_smali_methods) >= self.memo_size:
+            self.obj_smali_methods = {}
+        self.obj_smali_methods[java_method] = smali_method
         return smali_method
-        
-        
\ No newline at end of file
+
+
+# Per-process converter, used when converting with multiple workers.
+worker_converter = None
+
+def fn_initialise_worker(memo_size):
+    global worker_converter
+    worker_converter = SootToSmali(memo_size)
+
+def fn_convert_item(item):
+    apk, apk_obj = item
+    return apk, worker_converter.convert_apk_obj(apk_obj)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Converts the methods in a Soot-format UUID extractor '
+                      + 'output file to smali format.'
+    )
+    argparser.add_argument(
+        'in_json',
+        help = 'Soot-format extractor output.'
+    )
+    argparser.add_argument(
+        'out_json',
+        help = 'file to write the smali-format extractor output to, '
+               + 'e.g., input_output/uuid_extractor_output.json'
+    )
+    argparser.add_argument(
+        '-w',
+        '--workers',
+        type = int,
+        default = 1,
+        help = 'number of worker processes to convert with.'
+    )
+    args = argparser.parse_args()
+    SootToSmali().convert_soot_json_to_smali(
+        args.in_json,
+        args.out_json,
+        args.workers
+    )
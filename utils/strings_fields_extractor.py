@@ -1,12 +1,30 @@
 import os
-import json
+import sys
 import requests
-from androguard.misc import *
-from androguard.core import *
-from androguard import session
+
+# Recorded in the extraction manifest. Bump when the artifacts that
+#  are produced change, so that existing artifacts are re-extracted.
+# Version 2: targeted extraction was given no target methods.
+# Version 3: strings, fields and their orders match the cross-reference analysis.
+EXTRACTOR_VERSION = 3
+
+# Supported artifact formats.
+ARTIFACT_FORMAT_JSON = 'json'
+ARTIFACT_FORMAT_PACKED = 'packed'
+
+# Supported extraction modes. Full extraction covers every method in
+#  the APK. Targeted extraction only covers the methods listed for the
+#  APK in the UUID extractor output, which are the only ones that
+#  functionality mapping looks up.
+EXTRACTION_MODE_FULL = 'full'
+EXTRACTION_MODE_TARGETED = 'targeted'
 
 class StringsFieldsExtractor:
-    def __init__(self, basepath):
+    def __init__(self, basepath, artifact_format=ARTIFACT_FORMAT_JSON,
+                 extraction_mode=EXTRACTION_MODE_FULL):
+        self.base_dir = basepath
+        self.artifact_format = artifact_format
+        self.extraction_mode = extraction_mode
         self.io_dir = os.path.abspath(os.path.join(
             self.base_dir,
             'input_output'
@@ -35,90 +53,259 @@ class StringsFieldsExtractor:
             self.app_specific_dir,
             'fields'
         ))
+        self.packed_dir = os.path.abspath(os.path.join(
+            self.app_specific_dir,
+            'packed'
+        ))
+        self.extractor_output_file = os.path.abspath(os.path.join(
+            self.io_dir,
+            'uuid_extractor_output.json'
+        ))
+        
+        # The artifact section names, the packed artifact format and
+        #  the extractor output reader are shared with the functionality mapper.
+        sys.path.append(os.path.abspath(os.path.join(
+            self.base_dir,
+            'src',
+            'common'
+        )))
+        
+    def fn_get_version(self):
+        version = [EXTRACTOR_VERSION]
+        # Packed artifacts also depend on the version of the packed format.
+        if self.artifact_format == ARTIFACT_FORMAT_PACKED:
+            from packed_artifacts import PACKED_VERSION
+            version.append(PACKED_VERSION)
+        # Targeted artifacts also depend on each APK's target methods,
+        #  which are recorded per APK in the manifest.
+        if self.extraction_mode == EXTRACTION_MODE_TARGETED:
+            version.append(EXTRACTION_MODE_TARGETED)
+        if len(version) == 1:
+            return EXTRACTOR_VERSION
+        return version
+        
+    def fn_get_apk_name(self, path_to_apk):
+        filename = os.path.basename(path_to_apk)
+        return filename.replace('.apk', '')
+        
+    def fn_get_output_paths(self, path_to_apk):
+        apkname = self.fn_get_apk_name(path_to_apk)
+        if self.artifact_format == ARTIFACT_FORMAT_PACKED:
+            from packed_artifacts import PACKED_EXTENSION
+            return [
+                os.path.join(self.packed_dir, apkname + PACKED_EXTENSION)
+            ]
+        return [
+            os.path.join(self.strings_dir, apkname + '.json'),
+            os.path.join(self.fields_dir, apkname + '.json'),
+            os.path.join(self.fields_dir, apkname + '_xref_read.json'),
+            os.path.join(self.fields_dir, apkname + '_xref_write.json')
+        ]
         
+    def fn_get_target_methods(self, apk_list):
+        """Returns a dict of APK path -> list of the methods listed for the APK
+        (across all its UUIDs) in the extractor output. The extractor output
+        is keyed on APK name, which is the filename without the extension."""
+        from extractor_reader import ExtractorOutputReader
+        obj_apk_paths = {}
+        obj_target_methods = {}
+        for path_to_apk in apk_list:
+            apkname = self.fn_get_apk_name(path_to_apk)
+            if apkname not in obj_apk_paths:
+                obj_apk_paths[apkname] = []
+            obj_apk_paths[apkname].append(path_to_apk)
+            obj_target_methods[path_to_apk] = []
+        for apk, _, uuids in ExtractorOutputReader(self.extractor_output_file):
+            if apk not in obj_apk_paths:
+                continue
+            methods = dict.fromkeys(
+                method for uuid in uuids for method in uuids[uuid]['methods']
+            )
+            for path_to_apk in obj_apk_paths[apk]:
+                obj_target_methods[path_to_apk] = list(methods)
+        return obj_target_methods
         
-    def fn_extract_fields_and_strings(self, path_to_apk):
-        self.dx = None
+    def fn_extract_fields_and_strings(self, path_to_apk, target_methods=None):
+        """Extracts the artifacts of an APK. With target_methods,
+        only those methods are extracted. Returns False on failure."""
+        obj_targets = None
+        if target_methods != None:
+            obj_targets = self.fn_group_target_methods(target_methods)
+        
+        # APKs without UUIDs have no target methods, so need no analysis.
+        vms = []
+        if (obj_targets == None) or (len(obj_targets) > 0):
+            try:
+                vms = self.fn_load_dex(path_to_apk)
+            except:
+                return False
+        
+        artifact_writer = self.fn_get_artifact_writer(path_to_apk)
+        # Order in which strings are first encountered, across all DEX files.
+        obj_string_ranks = {}
         try:
-            sess = get_default_session()
-            _, _, self.dx = AnalyzeAPK(path_to_apk, session=sess)
+            for vm in vms:
+                self.fn_extract_dex(vm, obj_targets, artifact_writer, obj_string_ranks)
         except:
-            return
-            
-        filename = os.path.basename(path_to_apk)
-        apkname = filename.replace('.apk', '')
+            artifact_writer.fn_discard()
+            raise
+        artifact_writer.fn_close()
+        return True
+        
+    def fn_get_artifact_writer(self, path_to_apk):
+        from packed_artifacts import SECTION_NAMES
+        from artifact_writers import JsonArtifactWriter, PackedArtifactWriter
+        output_paths = self.fn_get_output_paths(path_to_apk)
+        if self.artifact_format == ARTIFACT_FORMAT_PACKED:
+            return PackedArtifactWriter(output_paths[0])
+        # JSON output paths are in section order.
+        return JsonArtifactWriter(dict(zip(SECTION_NAMES, output_paths)))
+        
+    def fn_load_dex(self, path_to_apk):
+        """Parses the DEX files of an APK, without the (whole-APK)
+        cross-reference analysis that AnalyzeAPK performs."""
+        try:
+            from androguard.core.apk import APK
+            from androguard.core.dex import DEX
+        except ImportError:
+            # Androguard 3.x
+            from androguard.core.bytecodes.apk import APK
+            from androguard.core.bytecodes.dvm import DalvikVMFormat as DEX
+        apk_obj = APK(path_to_apk)
+        return [DEX(dex_bytes) for dex_bytes in apk_obj.get_all_dex()]
         
-        # Extract strings.
-        strings_out = os.path.join(self.strings_dir, apkname + '.json')
-        self.fn_extract_strings(strings_out)
+    def fn_group_target_methods(self, target_methods):
+        """Returns a dict of class -> method name -> set of descriptors.
+        Descriptors are compared without spaces. A method without
+        a descriptor (e.g., converted from Soot format) has a
+        descriptor of None, and matches all overloads."""
+        obj_targets = {}
+        for class_method in target_methods:
+            if '->' not in class_method:
+                continue
+            class_name, method_desc = class_method.split('->', 1)
+            method_name = method_desc.split('(')[0]
+            descriptor = None
+            if '(' in method_desc:
+                descriptor = method_desc[len(method_name):].replace(' ', '')
+            if class_name not in obj_targets:
+                obj_targets[class_name] = {}
+            if method_name not in obj_targets[class_name]:
+                obj_targets[class_name][method_name] = set()
+            obj_targets[class_name][method_name].add(descriptor)
+        return obj_targets
         
-        # Extract fields.
-        fields_out = os.path.join(self.fields_dir, apkname + '.json')
-        self.fn_extract_fields(fields_out)
+    def fn_extract_dex(self, vm, obj_targets, artifact_writer, obj_string_ranks):
+        """Extracts the artifacts of one DEX file in a single pass over its
+        methods' instructions. const-string and field get/put instructions
+        are recorded as Androguard's (3.x) cross-reference analysis records them,
+        so artifacts are the same as those built from the Analysis object:
+        each method lists its distinct strings, in the order in which they are
+        first used in the APK, and the fields it reads/writes, in the order in
+        which they are first accessed by its class. Only fields that are
+        accessed are listed, by defining class.
+        With obj_targets, only the target methods are examined, so orders
+        are as first encountered within those methods."""
+        from packed_artifacts import SECTION_STRINGS, SECTION_FIELDS, \
+            SECTION_XREF_READ, SECTION_XREF_WRITE
         
-    def fn_extract_strings(self, outpath):
-        string_object = {}
-        all_strings_analysis_objs = self.dx.get_strings()
-        for string_analysis_obj in all_strings_analysis_objs:
-            string_value = string_analysis_obj.get_orig_value()
-            xref_from = string_analysis_obj.get_xref_from()
-            for element in xref_from:
-                class_name = element[1].get_class_name()
-                method_name = element[1].get_name()
-                desc_name = element[1].get_descriptor()
-                desc_name_only = desc_name
-                full_name = class_name + '->' + method_name + desc_name_only
-                if full_name not in string_object:
-                    string_object[full_name] = []
-                string_object[full_name].append(string_value)
-        with open(outpath, 'w') as f:
-            json.dump(string_object, f, indent=4)
+        # As in Androguard's cross-reference analysis, only fields that
+        #  are defined within the same DEX file are considered. (These are
+        #  taken from the class definitions, as from Androguard 4,
+        #  vm.get_fields() also returns fields that are only referenced.)
+        defined_fields = set()
+        for class_def in vm.get_classes():
+            for field in class_def.get_fields():
+                defined_fields.add((field.get_class_name(), field.get_name(), field.get_descriptor()))
             
-    def fn_extract_fields(self, outpath):
-        field_object = {}
-        field_xref_read = {}
-        field_xref_write = {}
-        for field_analysis in self.dx.find_fields():
-            field_name = field_analysis.get_field().get_name()
-
-            # Field definitions.
-            field_class = field_analysis.get_field().get_class_name()
-            if field_class not in field_object:
-                field_object[field_class] = []
-            if field_name not in field_object[field_class]:
-                field_object[field_class].append(field_name)
-
-            # Field reads.
-            for one_xref_read in field_analysis.get_xref_read():
-                field_xref_read_method = one_xref_read[1]
-                field_xref_read_class_method = \
-                    field_xref_read_method.get_class_name() \
-                    + '->' \
-                    + field_xref_read_method.get_name() \
-                    + field_xref_read_method.get_descriptor()
-                if field_xref_read_class_method not in field_xref_read:
-                    field_xref_read[field_xref_read_class_method] = []
-                if field_name not in field_xref_read[field_xref_read_class_method]:
-                    field_xref_read[field_xref_read_class_method].append(field_name)
-
-            # Field writes.
-            for one_xref_write in field_analysis.get_xref_write():
-                field_xref_write_method = one_xref_write[1]
-                field_xref_write_class_method = \
-                    field_xref_write_method.get_class_name() \
-                    + '->' \
-                    + field_xref_write_method.get_name() \
-                    + field_xref_write_method.get_descriptor()
-                if field_xref_write_class_method not in field_xref_write:
-                    field_xref_write[field_xref_write_class_method] = []
-                if field_name not in field_xref_write[field_xref_write_class_method]:
-                    field_xref_write[field_xref_write_class_method].append(field_name)
-
-        with open(outpath, 'w') as f:
-            json.dump(field_object, f, indent=4)
-        xref_read_outpath = outpath.replace('.json', '_xref_read.json')
-        with open(xref_read_outpath, 'w') as f:
-            json.dump(field_xref_read, f, indent=4)
-        xref_write_outpath = outpath.replace('.json', '_xref_write.json')
-        with open(xref_write_outpath, 'w') as f:
-            json.dump(field_xref_write, f, indent=4)
\ No newline at end of file
+        # Strings and field references are decoded once per DEX file.
+        #  Class and field names are interned, as they are repeated
+        #  across many entries.
+        obj_string_values = {}
+        obj_field_refs = {}
+        # Names of the accessed fields, by defining class.
+        accessed_field_classes = {}
+        
+        for class_def in vm.get_classes():
+            class_name = sys.intern(class_def.get_name())
+            obj_target_methods = None
+            if obj_targets != None:
+                if class_name not in obj_targets:
+                    continue
+                obj_target_methods = obj_targets[class_name]
+            # Order in which fields are first accessed (read or written) by the class.
+            obj_field_ranks = {}
+            for method in class_def.get_methods():
+                method_name = method.get_name()
+                descriptor = method.get_descriptor()
+                if obj_target_methods != None:
+                    if method_name not in obj_target_methods:
+                        continue
+                    descriptors = obj_target_methods[method_name]
+                    if (None not in descriptors) \
+                            and (descriptor.replace(' ', '') not in descriptors):
+                        continue
+                full_name = class_name + '->' + method_name + descriptor
+                
+                method_strings = {}
+                method_xref_read = {}
+                method_xref_write = {}
+                for instruction in method.get_instructions():
+                    op_value = instruction.get_op_value()
+                    # const-string, const-string/jumbo.
+                    if 0x1a <= op_value <= 0x1b:
+                        string_idx = instruction.get_ref_kind()
+                        if string_idx not in obj_string_values:
+                            string_value = vm.get_cm_string(string_idx)
+                            obj_string_values[string_idx] = string_value
+                            if string_value not in obj_string_ranks:
+                                obj_string_ranks[string_value] = len(obj_string_ranks)
+                        method_strings[obj_string_values[string_idx]] = None
+                    # iget*/iput* (0x52 - 0x5f), sget*/sput* (0x60 - 0x6d).
+                    elif 0x52 <= op_value <= 0x6d:
+                        field_idx = instruction.get_ref_kind()
+                        if field_idx not in obj_field_refs:
+                            field_class, field_type, field_name = vm.get_cm_field(field_idx)
+                            if (field_class, field_name, field_type) in defined_fields:
+                                obj_field_refs[field_idx] = (
+                                    sys.intern(field_class),
+                                    sys.intern(field_name)
+                                )
+                            else:
+                                obj_field_refs[field_idx] = None
+                        field_ref = obj_field_refs[field_idx]
+                        if field_ref == None:
+                            continue
+                        if field_idx not in obj_field_ranks:
+                            obj_field_ranks[field_idx] = len(obj_field_ranks)
+                            field_class, field_name = field_ref
+                            if field_class not in accessed_field_classes:
+                                accessed_field_classes[field_class] = {}
+                            accessed_field_classes[field_class][field_name] = None
+                        if (0x52 <= op_value <= 0x58) or (0x60 <= op_value <= 0x66):
+                            method_xref_read[field_idx] = None
+                        else:
+                            method_xref_write[field_idx] = None
+                
+                # Each method is complete once its instructions have been seen.
+                if len(method_strings) > 0:
+                    artifact_writer.fn_add(
+                        SECTION_STRINGS,
+                        full_name,
+                        sorted(method_strings, key=obj_string_ranks.get)
+                    )
+                for section_name, method_xref in [
+                        (SECTION_XREF_READ, method_xref_read),
+                        (SECTION_XREF_WRITE, method_xref_write)]:
+                    if len(method_xref) == 0:
+                        continue
+                    # Field names are listed once, even if fields of
+                    #  different classes share a name.
+                    field_names = dict.fromkeys(
+                        obj_field_refs[field_idx][1]
+                        for field_idx in sorted(method_xref, key=obj_field_ranks.get)
+                    )
+                    artifact_writer.fn_add(section_name, full_name, list(field_names))
+        
+        for field_class in accessed_field_classes:
+            artifact_writer.fn_add(SECTION_FIELDS, field_class, list(accessed_field_classes[field_class]))